@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark on a synthetic corpus. Known text is rendered with a
+local font into a PGS subtitle file, which ffmpeg transcodes to dvd_subtitle
+and dvb_subtitle streams over a lavfi video. The full subexport pipeline is
+then run on each video, and its throughput, stage times, the peak memory
+of its largest process and character error rate against the known text are
+reported.
+
+Run from the repository root:
+    python -m benchmarks.corpus -o before.json
+    python -m benchmarks.corpus -o after.json --compare before.json
+Arguments after -- are passed on to subexport.py, e.g. -- --adaptive.
+"""
+import json
+import os
+import platform
+import random
+import re
+import struct
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import ffmpeg
+import fonts
+from benchmarks import synthetic
+from benchmarks.micro import _commit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# ffmpeg encoders of the subtitle codecs subexport reads
+ENCODERS = {'dvd_subtitle': 'dvdsub', 'dvb_subtitle': 'dvbsub'}
+# frame rate of the generated video
+VIDEO_RATE = 25
+# fonts tried in order when no font is given
+FONT_NAMES = ('FreeSans', 'DejaVu Sans', 'Liberation Sans', 'Arial')
+FONT_PATHS = ('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+              '/usr/share/fonts/truetype/DejaVuSans-Bold.ttf')
+# PGS timestamps are in 90kHz ticks
+PGS_CLOCK = 90000
+# PGS segment types
+PCS, WDS, PDS, ODS, END = 0x16, 0x17, 0x14, 0x15, 0x80
+# the palette of rendered subtitles: transparent, outline and text
+TRANSPARENT, OUTLINE, TEXT = 0, 1, 2
+
+
+@dataclass
+class Cue:
+    start: float
+    end: float
+    text: str
+
+
+def cues(count: int, seed: int = 0) -> list[Cue]:
+    """
+    Ground truth subtitles: one or two lines of text, shown for one to four
+    seconds with short gaps in between.
+    """
+    rng = random.Random(seed)
+    result = []
+    start = 1.0
+    for _ in range(count):
+        lines = [synthetic.sentence(rng) for _ in range(rng.choice((1, 1, 2)))]
+        end = start + rng.randint(10, 40) / 10
+        result.append(Cue(start, end, '\n'.join(lines)))
+        start = end + rng.randint(2, 20) / 10
+    return result
+
+
+def find_font(name: str | None, size: int) -> ImageFont.ImageFont:
+    """
+    Load the named font, or the first of FONT_NAMES installed, in bold.
+    """
+    candidates = [name] if name else FONT_NAMES
+    for font_name in candidates:
+        font = fonts.get(font_name, 'bold') if fonts.installed else None
+        if font:
+            return ImageFont.truetype(font.filename, size)
+    for filename in FONT_PATHS:
+        if os.path.exists(filename):
+            return ImageFont.truetype(filename, size)
+    sys.stderr.write('No usable font found, using the Pillow default\n')
+    return ImageFont.load_default(size)
+
+
+def render(cue: Cue, font: ImageFont.ImageFont, width: int, height: int
+           ) -> tuple[np.ndarray, int, int]:
+    """
+    Render a cue centered near the bottom of the frame, without antialiasing
+    so that it only uses the three palette entries.
+    @return The palette indices of the bitmap and its position in the frame.
+    """
+    canvas = Image.new('L', (width, height), TRANSPARENT)
+    draw = ImageDraw.Draw(canvas)
+    draw.fontmode = '1'
+    size = font.size if hasattr(font, 'size') else height // 16
+    draw.multiline_text((width // 2, height - height // 12), cue.text,
+                        font=font, fill=TEXT, anchor='md', align='center',
+                        spacing=size // 4, stroke_width=max(2, size // 16),
+                        stroke_fill=OUTLINE)
+    x1, y1, x2, y2 = canvas.getbbox()
+    return np.asarray(canvas.crop((x1, y1, x2, y2))), x1, y1
+
+
+def _rle(bitmap: np.ndarray) -> bytes:
+    """
+    Run length encode a bitmap of palette indices as PGS object data.
+    """
+    data = bytearray()
+    for row in bitmap:
+        edges = np.flatnonzero(np.diff(row)) + 1
+        starts = np.concatenate(([0], edges))
+        ends = np.concatenate((edges, [len(row)]))
+        for start, end in zip(starts, ends):
+            color = int(row[start])
+            length = int(end - start)
+            while length:
+                run = min(length, 16383)
+                length -= run
+                if color and run < 3:
+                    data += bytes((color,)) * run
+                elif color == 0 and run < 64:
+                    data += bytes((0, run))
+                elif color == 0:
+                    data += bytes((0, 0x40 | run >> 8, run & 0xff))
+                elif run < 64:
+                    data += bytes((0, 0x80 | run, color))
+                else:
+                    data += bytes((0, 0xc0 | run >> 8, run & 0xff, color))
+        data += b'\0\0'
+    return bytes(data)
+
+
+def _ycrcb(color: tuple[int, int, int]) -> tuple[int, int, int]:
+    r, g, b = color
+    return (round(16 + 0.257 * r + 0.504 * g + 0.098 * b),
+            round(128 + 0.439 * r - 0.368 * g - 0.071 * b),
+            round(128 - 0.148 * r - 0.291 * g + 0.439 * b))
+
+
+def _segment(kind: int, pts: float, payload: bytes) -> bytes:
+    return (b'PG' + struct.pack('>IIBH', round(pts * PGS_CLOCK), 0, kind,
+                                len(payload)) + payload)
+
+
+def _display_set(pts: float, number: int, width: int, height: int,
+                 bitmap: np.ndarray | None = None, x: int = 0, y: int = 0,
+                 color: tuple[int, int, int] = (255, 255, 255)) -> bytes:
+    """
+    A PGS display set showing the bitmap at (x, y), or clearing the screen if
+    there is no bitmap.
+    """
+    if bitmap is None:
+        return (_segment(PCS, pts, struct.pack('>HHBHBBBB', width, height,
+                                               0x10, number, 0, 0, 0, 0))
+                + _segment(WDS, pts, struct.pack('>BBHHHH', 1, 0, 0, 0, 1, 1))
+                + _segment(END, pts, b''))
+    h, w = bitmap.shape
+    data = _rle(bitmap)
+    segments = [
+        _segment(PCS, pts, struct.pack('>HHBHBBBBHBBHH', width, height, 0x10,
+                                       number, 0x80, 0, 0, 1, 0, 0, 0, x, y)),
+        _segment(WDS, pts, struct.pack('>BBHHHH', 1, 0, x, y, w, h)),
+        _segment(PDS, pts, bytes((0, 0))
+                 + bytes((TRANSPARENT, 16, 128, 128, 0))
+                 + bytes((OUTLINE, 16, 128, 128, 255))
+                 + bytes((TEXT, *_ycrcb(color), 255))),
+    ]
+    # the object data is split over several segments if it's too long for one
+    first = struct.pack('>HBB', 0, 0, 0x80) + struct.pack(
+            '>I', len(data) + 4)[1:] + struct.pack('>HH', w, h)
+    chunk = 0xffff - len(first)
+    fragments = [first + data[:chunk]]
+    for n in range(chunk, len(data), 0xffff - 4):
+        fragments.append(struct.pack('>HBB', 0, 0, 0)
+                         + data[n:n + 0xffff - 4])
+    last = bytearray(fragments[-1])
+    last[3] |= 0x40
+    fragments[-1] = bytes(last)
+    segments.extend(_segment(ODS, pts, f) for f in fragments)
+    segments.append(_segment(END, pts, b''))
+    return b''.join(segments)
+
+
+def write_sup(filename: str, subtitles: list[Cue], width: int, height: int,
+              font: ImageFont.ImageFont, seed: int = 0):
+    rng = random.Random(seed)
+    with open(filename, 'wb') as outfile:
+        for n, cue in enumerate(subtitles):
+            bitmap, x, y = render(cue, font, width, height)
+            outfile.write(_display_set(cue.start, 2 * n, width, height,
+                                       bitmap, x, y,
+                                       rng.choice(synthetic.COLORS)))
+            outfile.write(_display_set(cue.end, 2 * n + 1, width, height))
+
+
+def make_video(sup: str, output: str, codec: str, width: int, height: int,
+               duration: float):
+    """
+    Transcode a PGS file to the given subtitle codec, muxed with a black
+    video of the same size.
+    """
+    ff = ffmpeg.Ffmpeg(output)
+    ff.input(f'color=size={width}x{height}:rate={VIDEO_RATE}:color=black'
+             f':duration={duration}').format('lavfi')
+    ff.input(sup).extra_args('-fix_sub_duration')
+    ff.map(0, 'v')
+    ff.map(1, 's')
+    ff.extra_args('-c:v', 'mpeg2video', '-c:s', ENCODERS[codec])
+    ff.run()
+    if not os.path.exists(output):
+        raise RuntimeError(f'ffmpeg failed to create {output}')
+
+
+def run_pipeline(video: str, output: str, stats_file: str,
+                 extra_args: list[str]) -> dict:
+    """
+    Run subexport.py in a separate process.
+    @return The wall time, the largest peak RSS of any single process in the
+        tree and stage statistics.
+    """
+    command = [sys.executable, os.path.join(ROOT, 'subexport.py'),
+               '-i', video, '-o', output, '--stats', stats_file, *extra_args]
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=ROOT)
+    # wait4 reports the usage of this run alone. Its ru_maxrss is the peak
+    # RSS of the largest of the process and its children, not their sum.
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise RuntimeError(f'subexport failed with {proc.returncode}')
+    with open(stats_file) as infile:
+        stage_stats = json.load(infile)
+    return {'wall': wall, 'max_process_rss_kb': usage.ru_maxrss,
+            'stats': stage_stats}
+
+
+def read_srt(filename: str) -> list[str]:
+    with open(filename) as infile:
+        blocks = infile.read().strip().split('\n\n')
+    texts = []
+    for block in blocks:
+        lines = block.strip().split('\n')
+        if len(lines) > 2:
+            texts.append(re.sub(r'<[^>]+>', '', '\n'.join(lines[2:])))
+    return texts
+
+
+def _document(texts: list[str]) -> str:
+    return '\n'.join(' '.join(text.split()) for text in texts)
+
+
+def edit_distance(a: str, b: str) -> int:
+    row = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        previous, row[0] = row[0], i
+        for j, cb in enumerate(b, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1,
+                                           previous + (ca != cb))
+    return row[-1]
+
+
+def cer(reference: list[str], hypothesis: list[str]) -> float:
+    """
+    The character error rate of the recognized subtitles, with the cues of
+    each joined into one document so that differently split or merged cues
+    aren't counted as errors.
+    """
+    reference = _document(reference)
+    return edit_distance(reference, _document(hypothesis)) / len(reference)
+
+
+def run(codec: str, args, extra_args: list[str]) -> dict:
+    width, height = (int(d) for d in args.video_size.split('x'))
+    subtitles = cues(args.count, args.seed)
+    duration = subtitles[-1].end + 2
+    prefix = os.path.join(args.workdir, f'{codec}-{args.seed}')
+    font = find_font(args.font, height // 16)
+    write_sup(f'{prefix}.sup', subtitles, width, height, font, args.seed)
+    make_video(f'{prefix}.sup', f'{prefix}.mkv', codec, width, height,
+               duration)
+    result = run_pipeline(f'{prefix}.mkv', f'{prefix}.srt',
+                          f'{prefix}.json', extra_args)
+    frames = duration * VIDEO_RATE
+    timers = result['stats']['timers']
+    return {
+        'cues': len(subtitles),
+        'duration': duration,
+        'wall': round(result['wall'], 3),
+        'fps': round(frames / result['wall'], 1),
+        'speed': round(duration / result['wall'], 2),
+        'max_process_rss_mb': round(result['max_process_rss_kb'] / 1024,
+                                    1),
+        'cer': round(cer([c.text for c in subtitles],
+                         read_srt(f'{prefix}.srt')), 4),
+        'stages': {name: timer['wall'] for name, timer in timers.items()},
+        'counters': result['stats']['counters'],
+    }
+
+
+def compare(old: dict, new: dict):
+    sys.stderr.write(f'{"codec":<14} {"metric":<18} {"old":>10} '
+                     f'{"new":>10}\n')
+    for codec, result in new['results'].items():
+        if codec not in old['results']:
+            continue
+        for metric in ('fps', 'wall', 'max_process_rss_mb', 'cer'):
+            sys.stderr.write(f'{codec:<14} {metric:<18} '
+                             f'{old["results"][codec][metric]:>10} '
+                             f'{result[metric]:>10}\n')
+
+
+def main(args, extra_args):
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {}
+    for codec in args.codec or ENCODERS:
+        sys.stderr.write(f'{codec}...\n')
+        results[codec] = run(codec, args, extra_args)
+    report = {'commit': _commit(), 'python': platform.python_version(),
+              'count': args.count, 'seed': args.seed,
+              'video_size': args.video_size, 'subexport_args': extra_args,
+              'results': results}
+    with open(args.output, 'w') if args.output else sys.stdout as outfile:
+        json.dump(report, outfile, indent=2)
+        outfile.write('\n')
+    if args.compare:
+        with open(args.compare) as infile:
+            compare(json.load(infile), report)
+    if args.max_cer is not None:
+        failed = [codec for codec, result in results.items()
+                  if result['cer'] > args.max_cer]
+        if failed:
+            sys.stderr.write(f'Character error rate above {args.max_cer} '
+                             f'for {", ".join(failed)}\n')
+            exit(1)
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    extra_args = []
+    if '--' in argv:
+        extra_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    argparser = ArgumentParser()
+    argparser.add_argument('-n', '--count', type=int, default=40,
+                           help="Number of subtitles in each video.")
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--codec', action='append', choices=ENCODERS,
+                           help="Only benchmark this subtitle codec. Can be "
+                           "given more than once. Default is all of them.")
+    argparser.add_argument('--video-size', default='720x576')
+    argparser.add_argument('-t', '--font', default=None,
+                           help="The font to render the subtitles with. "
+                           "Default is the first installed of "
+                           f"{', '.join(FONT_NAMES)}.")
+    argparser.add_argument('-w', '--workdir', default='/tmp/corpus',
+                           help="Where the generated videos and results are "
+                           "kept.")
+    argparser.add_argument('-o', '--output', default=None,
+                           help="Write the JSON results here instead of "
+                           "stdout.")
+    argparser.add_argument('-c', '--compare', default=None, metavar='FILE',
+                           help="Print a comparison against an earlier "
+                           "result file.")
+    argparser.add_argument('--max-cer', type=float, default=None,
+                           help="Exit with an error if the character error "
+                           "rate of any codec is above this.")
+    main(argparser.parse_args(argv), extra_args)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the OCR post-processing and subtitle rendering hot paths.
+
+Run from the repository root:
+    python -m benchmarks.micro -o before.json
+    python -m benchmarks.micro -o after.json --compare before.json
+"""
+import json
+import platform
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from copy import deepcopy
+from statistics import median
+
+import ocr
+import tesseract
+from subtitles import Subtitles, SubtitleEntry
+from benchmarks import synthetic
+
+
+def measure(func, setup=None, repeat: int = 5, min_time: float = 0.2
+            ) -> dict:
+    """
+    Time func(*setup()). setup is called before every call and is not part
+    of the measurement. Each of the repeat rounds runs func at least once and
+    until min_time has passed.
+    """
+    rounds = []
+    calls = 0
+    for _ in range(repeat):
+        elapsed = 0.0
+        loops = 0
+        while loops == 0 or elapsed < min_time:
+            args = setup() if setup else ()
+            start = time.perf_counter()
+            func(*args)
+            elapsed += time.perf_counter() - start
+            loops += 1
+        rounds.append(elapsed / loops)
+        calls += loops
+    return {'best': min(rounds), 'median': median(rounds), 'calls': calls}
+
+
+def _subtitles(lines):
+    subs = Subtitles()
+    for line in lines:
+        style = subs.style(fontname='FreeSans', fontsize=line.size,
+                           primarycolour='FFFFFF', italic=line.italic,
+                           bold=line.bold)
+        subs.entry(SubtitleEntry(line.content, line.start, line.end,
+                                 style.name, marginl=line.marginl,
+                                 marginr=line.marginr, marginv=line.marginv))
+    return subs
+
+
+def cases(size: int):
+    lines = synthetic.text_lines(size)
+    sizes = [line.size for line in lines]
+    hocr = synthetic.hocr(3).encode('utf-8')
+    crop = synthetic.color_crop()
+    frame = synthetic.frame()
+    subs = _subtitles(lines)
+
+    yield 'normalize_values', ocr.normalize_values, \
+        lambda: (deepcopy(lines),)
+    yield 'merge_lines', ocr.merge_lines, lambda: (deepcopy(lines),)
+    yield 'freq_sort', ocr.freq_sort, lambda: (sizes,)
+    yield 'line_color', ocr.line_color, \
+        lambda: (crop, (0, 0, crop.width, crop.height))
+    yield 'parse_hocr', tesseract.parse_hocr, lambda: (hocr,)
+    yield 'parse_hocr_etree', tesseract.parse_hocr_etree, lambda: (hocr,)
+    yield 'encode_png', tesseract._encode, lambda: (frame, 'png')
+    yield 'encode_pnm', tesseract._encode, lambda: (frame, 'pnm')
+    yield 'Subtitles.style', _subtitles, lambda: (lines,)
+    yield 'Subtitles.srt', subs.srt, None
+    yield 'Subtitles.ssa', subs.ssa, None
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+                ('git', 'rev-parse', '--short', 'HEAD'),
+                stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: dict, new: dict):
+    sys.stderr.write(f'{"benchmark":<20} {"old":>12} {"new":>12} '
+                     f'{"ratio":>7}\n')
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        before = old['results'][name]['best']
+        after = result['best']
+        sys.stderr.write(f'{name:<20} {before * 1e6:10.1f}us '
+                         f'{after * 1e6:10.1f}us {after / before:7.2f}\n')
+
+
+def main(args):
+    results = {}
+    for name, func, setup in cases(args.size):
+        if args.filter and args.filter not in name:
+            continue
+        sys.stderr.write(f'{name}...\n')
+        results[name] = measure(func, setup, args.repeat, args.min_time)
+    report = {'commit': _commit(), 'python': platform.python_version(),
+              'size': args.size, 'results': results}
+    with open(args.output, 'w') if args.output else sys.stdout as outfile:
+        json.dump(report, outfile, indent=2)
+        outfile.write('\n')
+    if args.compare:
+        with open(args.compare) as infile:
+            compare(json.load(infile), report)
+
+
+if __name__ == '__main__':
+    argparser = ArgumentParser()
+    argparser.add_argument('-n', '--size', type=int, default=1000,
+                           help="Number of synthetic subtitle lines.")
+    argparser.add_argument('-r', '--repeat', type=int, default=5)
+    argparser.add_argument('-t', '--min-time', type=float, default=0.2,
+                           help="Minimum time in seconds for each round.")
+    argparser.add_argument('-k', '--filter', default=None,
+                           help="Only run benchmarks containing this text.")
+    argparser.add_argument('-o', '--output', default=None,
+                           help="Write the JSON results here instead of "
+                           "stdout.")
+    argparser.add_argument('-c', '--compare', default=None, metavar='FILE',
+                           help="Print a comparison against an earlier "
+                           "result file.")
+    main(argparser.parse_args())
@@ -0,0 +1,142 @@
+"""
+Deterministic synthetic data for the benchmarks. Every generator takes a seed
+so that runs on different commits work on exactly the same input.
+"""
+import random
+
+from PIL import Image, ImageDraw
+
+from ocr import TextLine
+
+WORDS = ('the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog',
+         "don't", 'I', 'you', 'what', 'never', 'again', 'Hello,', 'there!')
+COLORS = ((255, 255, 255), (255, 255, 0), (0, 255, 255), (250, 250, 250),
+          (255, 254, 0))
+
+
+def sentence(rng: random.Random, words: int = 6) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, words)))
+
+
+def text_lines(count: int, seed: int = 0, height: int = 1080
+               ) -> list[TextLine]:
+    """
+    A list of TextLines resembling the output of read_subs: mostly one or two
+    lines per frame, at a few slightly jittered positions, sizes and colors.
+    """
+    rng = random.Random(seed)
+    lines = []
+    time = 0.0
+    while len(lines) < count:
+        time += rng.randint(1, 40) / 10
+        end = time + rng.randint(5, 50) / 10
+        content = sentence(rng)
+        size = rng.choice((54, 54, 54, 48, 72)) + rng.randint(-1, 1)
+        color = rng.choice(COLORS)
+        for n in range(rng.choice((1, 1, 2))):
+            marginv = height // 12 + n * size + rng.randint(-3, 3)
+            lines.append(TextLine(time, content, size, False, False,
+                                  rng.randint(300, 320), rng.randint(300, 320),
+                                  marginv, color, end))
+            # sometimes the same text continues into the next frame
+            if rng.random() < 0.2:
+                lines.append(TextLine(end, content, size, False, False,
+                                      lines[-1].marginl, lines[-1].marginr,
+                                      marginv, color, end + 1))
+    return lines[:count]
+
+
+HOCR_HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <head>
+  <title></title>
+  <meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>
+  <meta name='ocr-system' content='tesseract 5.3.0' />
+  <meta name='ocr-capabilities' content='ocr_page ocr_carea ocr_par \
+ocr_line ocrx_word ocrp_wconf'/>
+ </head>
+ <body>
+  <div class='ocr_page' id='page_1' title='image "-"; bbox 0 0 {width} \
+{height}; ppageno 0; scan_res 70 70'>
+'''
+HOCR_FOOTER = '''  </div>
+ </body>
+</html>
+'''
+
+
+def hocr(lines: int = 3, seed: int = 0, width: int = 1920,
+         height: int = 1080) -> str:
+    """
+    A hOCR document in the layout tesseract 5 produces, with one block and
+    paragraph per line and a mix of plain, italic and bold words.
+    """
+    rng = random.Random(seed)
+    doc = [HOCR_HEADER.format(width=width, height=height)]
+    y = height - 100 - lines * 60
+    for n in range(1, lines + 1):
+        text = sentence(rng, 10).split()
+        x = rng.randint(200, 400)
+        x2 = x + 60 * len(text)
+        bbox = f'{x} {y} {x2} {y + 50}'
+        doc.append(f"   <div class='ocr_carea' id='block_1_{n}' "
+                   f"title=\"bbox {bbox}\">\n"
+                   f"    <p class='ocr_par' id='par_1_{n}' lang='eng' "
+                   f"title=\"bbox {bbox}\">\n"
+                   f"     <span class='ocr_line' id='line_1_{n}' "
+                   f"title=\"bbox {bbox}; baseline 0.001 -11; x_size 44; "
+                   f"x_descenders 11; x_ascenders 10\">\n")
+        for i, word in enumerate(text):
+            word = word.replace('&', '&amp;').replace("'", '&#39;')
+            match rng.randint(0, 5):
+                case 0:
+                    word = f'<em>{word}</em>'
+                case 1:
+                    word = f'<strong>{word}</strong>'
+            doc.append(f"      <span class='ocrx_word' id='word_1_{n}_{i}' "
+                       f"title='bbox {x + 60 * i} {y} {x + 60 * i + 55} "
+                       f"{y + 50}; x_wconf {rng.randint(50, 96)}'>"
+                       f"{word}</span>\n")
+        doc.append('     </span>\n    </p>\n   </div>\n')
+        y += 60
+    doc.append(HOCR_FOOTER)
+    return ''.join(doc)
+
+
+def color_crop(width: int = 800, height: int = 60, seed: int = 0
+               ) -> Image.Image:
+    """
+    A subtitle-like crop: colored glyph-sized blobs with a dark outline and
+    antialiased edges on a black background.
+    """
+    rng = random.Random(seed)
+    color = rng.choice(COLORS)
+    image = Image.new('RGB', (width, height))
+    draw = ImageDraw.Draw(image)
+    x = 4
+    while x < width - 40:
+        w = rng.randint(12, 30)
+        top = rng.randint(4, height // 3)
+        box = (x, top, x + w, height - 4)
+        draw.rectangle(box, fill=(20, 20, 20))
+        draw.rectangle((box[0] + 2, box[1] + 2, box[2] - 2, box[3] - 2),
+                       fill=tuple(c * 3 // 4 for c in color))
+        draw.rectangle((box[0] + 3, box[1] + 3, box[2] - 3, box[3] - 3),
+                       fill=color)
+        x += w + rng.randint(3, 20)
+    return image
+
+
+def frame(width: int = 1920, height: int = 1080, seed: int = 0
+          ) -> Image.Image:
+    """
+    A grayscale frame as fed to tesseract, with two subtitle lines near the
+    bottom.
+    """
+    image = Image.new('L', (width, height))
+    for n in range(2):
+        crop = color_crop(width * 2 // 3, height // 18, seed + n).convert('L')
+        image.paste(crop, (width // 6, height * 5 // 6 + n * crop.height))
+    return image
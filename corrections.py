@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+A persistent store of the disagreements between the two tesseract engines
+that verify_text has resolved. Each decision is recorded per token pair, so
+that once a pair (say '|' and 'I') has been resolved the same way often
+enough, later lines containing it are resolved without running the extra
+readings again.
+
+The store is an sqlite database, which keeps it safe to update from several
+pool workers at once. Set SUBCONVERT_CORRECTIONS (or use --corrections) to the
+database file to enable it.
+"""
+import os
+import sqlite3
+import sys
+import time
+
+# how often a pair must have resolved to the same winner before it's trusted
+MIN_COUNT = 3
+# the share of all decisions for a pair that the winner must have
+MIN_RATIO = 0.9
+# decisions not seen for this long are removed by prune()
+EXPIRY_DAYS = 180
+# prune() keeps at most this many of the most recently seen decisions
+MAX_ENTRIES = 100000
+
+
+class CorrectionStore:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.db = sqlite3.connect(filename, timeout=30)
+        self.db.execute('CREATE TABLE IF NOT EXISTS corrections ('
+                        'text0 TEXT, text1 TEXT, winner TEXT, '
+                        'count INTEGER, last_seen REAL, '
+                        'PRIMARY KEY (text0, text1, winner))')
+        self.db.commit()
+
+    def record(self, text0: str, text1: str, winner: str):
+        with self.db:
+            self.db.execute('INSERT INTO corrections VALUES (?, ?, ?, 1, ?) '
+                            'ON CONFLICT (text0, text1, winner) DO UPDATE '
+                            'SET count = count + 1, last_seen = ?',
+                            (text0, text1, winner, time.time(), time.time()))
+
+    def touch(self, text0: str, text1: str, winner: str):
+        """
+        Mark a trusted decision as used, which keeps prune() from expiring
+        it. Its count is left alone, since using it is no evidence that it
+        is right.
+        """
+        with self.db:
+            self.db.execute('UPDATE corrections SET last_seen = ? '
+                            'WHERE text0 = ? AND text1 = ? AND winner = ?',
+                            (time.time(), text0, text1, winner))
+
+    def lookup(self, text0: str, text1: str) -> str | None:
+        """
+        The trusted winner for a token pair, or None if there isn't one.
+        """
+        rows = self.db.execute('SELECT winner, count FROM corrections '
+                               'WHERE text0 = ? AND text1 = ? '
+                               'ORDER BY count DESC',
+                               (text0, text1)).fetchall()
+        if not rows:
+            return None
+        winner, count = rows[0]
+        total = sum(c for _, c in rows)
+        if count >= MIN_COUNT and count >= total * MIN_RATIO:
+            return winner
+        return None
+
+    def resolve(self, text0: str, text1: str) -> str | None:
+        """
+        Resolve two readings of a line if every token where they disagree is
+        a known pair. Returns None if the line still needs to be verified.
+        The decisions used are touched.
+        """
+        tokens0 = text0.split()
+        tokens1 = text1.split()
+        if len(tokens0) != len(tokens1) or tokens0 == tokens1:
+            return None
+        result = []
+        used = []
+        for token0, token1 in zip(tokens0, tokens1):
+            if token0 != token1:
+                winner = self.lookup(token0, token1)
+                if winner is None:
+                    return None
+                used.append((token0, token1, winner))
+                token0 = winner
+            result.append(token0)
+        for decision in used:
+            self.touch(*decision)
+        return ' '.join(result)
+
+    def learn(self, text0: str, text1: str, result: str):
+        """
+        Record the winner of each disagreeing token pair from a line that
+        verify_text resolved. Lines where the readings don't split into the
+        same number of tokens are skipped.
+        """
+        tokens = [t.split() for t in (text0, text1, result)]
+        if len(set(len(t) for t in tokens)) != 1:
+            return
+        for token0, token1, winner in zip(*tokens):
+            if token0 != token1:
+                self.record(token0, token1, winner)
+
+    def entries(self) -> list[tuple[str, str, str, int, float]]:
+        return self.db.execute('SELECT * FROM corrections '
+                               'ORDER BY text0, text1, count DESC').fetchall()
+
+    def prune(self, expiry_days: float = EXPIRY_DAYS,
+              max_entries: int = MAX_ENTRIES) -> int:
+        """
+        Remove expired decisions and the least recently seen ones beyond
+        max_entries. Returns the number of rows removed.
+        """
+        with self.db:
+            removed = self.db.execute(
+                    'DELETE FROM corrections WHERE last_seen < ?',
+                    (time.time() - expiry_days * 86400,)).rowcount
+            removed += self.db.execute(
+                    'DELETE FROM corrections WHERE rowid NOT IN (SELECT '
+                    'rowid FROM corrections ORDER BY last_seen DESC '
+                    'LIMIT ?)', (max_entries,)).rowcount
+        self.db.execute('VACUUM')
+        return removed
+
+    def clear(self):
+        with self.db:
+            self.db.execute('DELETE FROM corrections')
+        self.db.execute('VACUUM')
+
+
+_stores = {}
+
+
+def store() -> CorrectionStore | None:
+    """
+    The correction store configured with SUBCONVERT_CORRECTIONS, opened once
+    per process, or None if there isn't one.
+    """
+    filename = os.getenv('SUBCONVERT_CORRECTIONS')
+    if not filename:
+        return None
+    key = (os.getpid(), filename)
+    if key not in _stores:
+        _stores[key] = CorrectionStore(filename)
+    return _stores[key]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[2] not in ('show', 'prune', 'clear'):
+        print(f'Usage: {sys.argv[0]} DATABASE show|prune|clear')
+        exit(-1)
+
+    corrections = CorrectionStore(sys.argv[1])
+    match sys.argv[2]:
+        case 'show':
+            # trusted decisions are marked with a *
+            for text0, text1, winner, count, last_seen in \
+                    corrections.entries():
+                seen = time.strftime('%Y-%m-%d', time.localtime(last_seen))
+                trusted = corrections.lookup(text0, text1) == winner
+                print(f'{text0!r:>16} | {text1!r:<16} -> {winner!r:<16} '
+                      f'{count:6d} {seen}{" *" if trusted else ""}')
+        case 'prune':
+            print(f'Removed {corrections.prune()} entries')
+        case 'clear':
+            corrections.clear()
@@ -0,0 +1,380 @@
+"""
+Runs OCR tasks on other machines. The Coordinator can stand in for the
+multiprocessing Pool of read_subs: it queues the tasks, serves them to the
+workers which connect to it over TCP, and resolves each task with the result
+a worker sends back. Workers are started with `subexport.py worker HOST:PORT`.
+
+The protocol is one JSON message per line. A worker says hello, then receives
+a task, sends its result, and receives the next one until the coordinator
+tells it to exit. The image files a task reads are sent along with it, base64
+encoded. Only functions registered with @task can be run, and only
+dataclasses registered with @serializable can be passed, so a worker never
+runs code it was sent.
+
+Tasks lost with a worker, or which fail on it, are queued again at the front
+and retried up to MAX_ATTEMPTS times. The coordinator also runs tasks in a
+local pool, so it works without any workers connected, and tasks which keep
+failing remotely get a last try locally.
+"""
+import base64
+import dataclasses
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.pool import Pool
+
+import governor
+
+# attempts before a task is only retried locally, or given up on
+MAX_ATTEMPTS = 3
+# seconds a worker has to return the result of a task
+TASK_TIMEOUT = 300
+# seconds between attempts of a worker to reach its coordinator
+RECONNECT_DELAY = 5
+
+TASKS = {}
+TYPES = {}
+
+
+def task(func):
+    """
+    Register a function which workers may run. Its first argument is an
+    image file or a list of them, which are sent along with the task. Its
+    other arguments and its result must be encodable by encode().
+    """
+    TASKS[func.__qualname__] = func
+    return func
+
+
+def serializable(cls):
+    """
+    Register a dataclass which may be passed to and returned from tasks.
+    """
+    TYPES[cls.__name__] = cls
+    return cls
+
+
+def encode(value):
+    """
+    Turn a value made of dicts, lists, tuples, plain values and registered
+    dataclasses into JSON data.
+    """
+    if dataclasses.is_dataclass(value) and type(value).__name__ in TYPES:
+        return {'__type__': type(value).__name__,
+                'fields': {f.name: encode(getattr(value, f.name))
+                           for f in dataclasses.fields(value)}}
+    if isinstance(value, tuple):
+        return {'__tuple__': [encode(v) for v in value]}
+    if isinstance(value, list):
+        return [encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: encode(v) for k, v in value.items()}
+    return value
+
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if '__tuple__' in value:
+        return tuple(decode(v) for v in value['__tuple__'])
+    if '__type__' in value:
+        return TYPES[value['__type__']](**decode(value['fields']))
+    return {k: decode(v) for k, v in value.items()}
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """
+    Split HOST:PORT. Without a host, all interfaces are meant.
+    """
+    host, _, port = address.rpartition(':')
+    return host.strip('[]'), int(port)
+
+
+def send(stream, message: dict):
+    stream.write(json.dumps(message).encode('utf-8') + b'\n')
+    stream.flush()
+
+
+def receive(stream) -> dict | None:
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class Task(Future):
+    """
+    The pending result of a task, with the get() and ready() of a Pool's
+    AsyncResult.
+    """
+    def __init__(self, func, args: tuple):
+        super().__init__()
+        self.func = func
+        self.args = args
+        self.attempts = 0
+        self.local_only = False
+
+    def get(self, timeout: float | None = None):
+        return self.result(timeout)
+
+    def ready(self) -> bool:
+        return self.done()
+
+    def message(self, task_id: int) -> dict:
+        images = self.args[0]
+        files = [images] if isinstance(images, str) else images
+        encoded = []
+        for filename in files:
+            with open(filename, 'rb') as infile:
+                encoded.append({'name': os.path.basename(filename),
+                                'data': base64.b64encode(
+                                        infile.read()).decode('ascii')})
+        return {'op': 'task', 'id': task_id, 'task': self.func.__qualname__,
+                'files': encoded, 'single': isinstance(images, str),
+                'args': encode(self.args[1:])['__tuple__']}
+
+
+class Coordinator:
+    """
+    Serves tasks to remote workers and to a local pool.
+
+    args:
+        address: The (host, port) to listen on for workers, or None to only
+            run tasks locally.
+        local: The number of local pool processes, 0 for none. Defaults to
+            the governor's workers.
+        timeout: Seconds a worker may take for one task before it's
+            considered lost.
+    """
+    def __init__(self, address: tuple[str, int] | None = None,
+                 local: int | None = None, timeout: float = TASK_TIMEOUT):
+        self.timeout = timeout
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.next_id = 0
+        self.workers = 0
+        self.listener = None
+        self.threads = []
+        if address:
+            self.listener = socket.create_server(address)
+            self.address = self.listener.getsockname()[:2]
+            self._thread(self._accept)
+        local = governor.plan().workers if local is None else local
+        self.pool = Pool(local) if local else None
+        for _ in range(local):
+            self._thread(self._run_local)
+
+    def _thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def apply_async(self, func, args: tuple = ()) -> Task:
+        if TASKS.get(func.__qualname__) is not func:
+            raise ValueError(f'{func.__qualname__} is not a registered task')
+        task = Task(func, args)
+        with self.condition:
+            self.queue.append(task)
+            self.condition.notify_all()
+        return task
+
+    def _take(self, remote: bool) -> Task | None:
+        """
+        Wait for the first queued task this kind of runner may take, or for
+        the coordinator to close.
+        """
+        with self.condition:
+            while not self.closed:
+                for task in self.queue:
+                    if not (remote and task.local_only):
+                        self.queue.remove(task)
+                        return task
+                self.condition.wait()
+            return None
+
+    def _retry(self, task: Task, error: str):
+        task.attempts += 1
+        if task.attempts >= MAX_ATTEMPTS:
+            if not self.pool or task.local_only:
+                task.set_exception(RuntimeError(
+                        f'{task.func.__qualname__} failed {task.attempts} '
+                        f'times: {error}'))
+                return
+            task.local_only = True
+        sys.stderr.write(f'Retrying {task.func.__qualname__}: {error}\n')
+        with self.condition:
+            # retried tasks go first, they hold up the ordered results
+            self.queue.appendleft(task)
+            self.condition.notify_all()
+
+    def _run_local(self):
+        while (task := self._take(remote=False)) is not None:
+            try:
+                task.set_result(self.pool.apply(task.func, task.args))
+            except Exception as e:
+                self._retry(task, repr(e))
+
+    def _accept(self):
+        while not self.closed:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self._thread(self._serve, conn)
+
+    def _serve(self, conn: socket.socket):
+        with conn, conn.makefile('rwb') as stream:
+            try:
+                hello = receive(stream)
+            except (OSError, ValueError):
+                return
+            if not hello or hello.get('op') != 'hello':
+                return
+            with self.condition:
+                self.workers += 1
+            try:
+                self._serve_tasks(conn, stream)
+            finally:
+                with self.condition:
+                    self.workers -= 1
+
+    def _serve_tasks(self, conn: socket.socket, stream):
+        while (task := self._take(remote=True)) is not None:
+            with self.condition:
+                task_id = self.next_id
+                self.next_id += 1
+            try:
+                message = task.message(task_id)
+            except OSError as e:
+                task.set_exception(e)
+                continue
+            try:
+                conn.settimeout(self.timeout)
+                send(stream, message)
+                reply = receive(stream)
+            except (OSError, ValueError) as e:
+                reply = {'op': 'error', 'error': f'worker lost: {e!r}'}
+            if not reply or reply.get('id') != task_id:
+                reply = {'op': 'error', 'error': 'worker lost'}
+            if reply['op'] == 'result':
+                task.set_result(decode(reply['result']))
+                continue
+            self._retry(task, reply['error'])
+            if 'lost' in reply['error']:
+                return
+        try:
+            send(stream, {'op': 'exit'})
+        except OSError:
+            pass
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.listener:
+            try:
+                # wakes up the accepting thread
+                self.listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.listener.close()
+        for thread in self.threads:
+            thread.join()
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def _run_task(message: dict, directory: str, pool: Pool | None):
+    """
+    Write the files of a task to the work directory and run it.
+    """
+    files = []
+    for entry in message['files']:
+        filename = os.path.join(directory, 'work',
+                                os.path.basename(entry['name']))
+        with open(filename, 'wb') as outfile:
+            outfile.write(base64.b64decode(entry['data']))
+        files.append(filename)
+    func = TASKS[message['task']]
+    args = (files[0] if message['single'] else files,
+            *decode(message['args']))
+    try:
+        if pool:
+            return pool.apply(func, args)
+        return func(*args)
+    finally:
+        for filename in files:
+            os.remove(filename)
+
+
+def _work(address: tuple[str, int], directory: str, pool: Pool | None
+          ) -> bool:
+    """
+    Run tasks from the coordinator until it says to exit.
+    @return False if the coordinator couldn't be reached.
+    """
+    try:
+        conn = socket.create_connection(address)
+    except OSError:
+        return False
+    with conn, conn.makefile('rwb') as stream:
+        send(stream, {'op': 'hello'})
+        while (message := receive(stream)) and message['op'] == 'task':
+            try:
+                reply = {'op': 'result', 'id': message['id'],
+                         'result': encode(_run_task(message, directory,
+                                                    pool))}
+            except Exception as e:
+                reply = {'op': 'error', 'id': message['id'],
+                         'error': repr(e)}
+            send(stream, reply)
+    return True
+
+
+def worker(address: tuple[str, int], jobs: int | None = None,
+           once: bool = False):
+    """
+    Connect to a coordinator and run its tasks, over jobs parallel
+    connections. Reconnects when the coordinator closes or can't be reached,
+    so that the worker serves one conversion after another.
+    @param jobs The number of tasks run at once. Defaults to the governor's
+        workers.
+    @param once Return as soon as the coordinator has closed.
+    """
+    jobs = jobs or governor.plan().workers
+    with tempfile.TemporaryDirectory(prefix='subconvert-') as directory:
+        pool = Pool(jobs) if jobs > 1 else None
+
+        def connection(n):
+            # read_image saves some crops next to the work directory
+            subdirectory = os.path.join(directory, str(n))
+            os.makedirs(os.path.join(subdirectory, 'work'))
+            os.makedirs(os.path.join(subdirectory, 'cropped'))
+            while not _work(address, subdirectory, pool) or not once:
+                time.sleep(RECONNECT_DELAY)
+
+        threads = [threading.Thread(target=connection, args=(n,),
+                                    daemon=True) for n in range(jobs)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if pool:
+            pool.close()
+            pool.join()
@@ -1,7 +1,51 @@
 
+import contextvars
 import json
+import os
+import queue
+import select
 import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
 from shutil import which
+from typing import Callable, Iterator
+
+import stats
+
+# how often the progress reader wakes up to check for a stall, in seconds
+STALL_POLL = 0.5
+
+
+class Stalled(Exception):
+    """
+    Raised by Ffmpeg.wait when ffmpeg was killed because it stopped making
+    progress.
+    """
+
+
+@dataclass
+class Progress:
+    frame: int = 0
+    fps: float = 0.0
+    out_time: float = 0.0  # seconds of output written
+    speed: float = 0.0  # multiple of real time
+    finished: bool = False
+
+    @classmethod
+    def parse(cls, values: dict[str, str]):
+        """
+        Create a Progress from the key=value pairs of one -progress block.
+        """
+        def number(key, scale=1.0):
+            try:
+                return float(values.get(key, '').rstrip('x')) * scale
+            except ValueError:
+                return 0.0
+        out_time = number('out_time_us', 1e-6) or number('out_time_ms', 1e-6)
+        return cls(int(number('frame')), number('fps'), out_time,
+                   number('speed'), values.get('progress') == 'end')
 
 
 def info(filename: str, ffprobe_binary: str | None = None):
@@ -31,6 +75,12 @@ class Ffmpeg:
         self.start_time = 0
         self.end_time = 0
         self.proc: subprocess.Popen = None
+        self.progress_callbacks = []
+        self.stall_timeout = None
+        self.last_progress: Progress | None = None
+        self.stalled = False
+        self._progress_thread = None
+        self._updates = None
 
     def time_range(self, start: float | int = 0, end: float | int = 0):
         self.start_time = start
@@ -62,8 +112,43 @@ class Ffmpeg:
         self.extra_arguments.extend(args)
         return self
 
-    def get_command(self):
+    def threads(self, count: int):
+        """
+        Limit the threads of the filter graph and of the encoders.
+        """
+        return self.extra_args('-filter_complex_threads', str(count),
+                               '-threads', str(count))
+
+    def progress(self, callback: Callable[[Progress], None] | None = None,
+                 stall_timeout: float | None = None):
+        """
+        Have ffmpeg report its progress, which is read in a background thread
+        while it runs. Can be called more than once to add callbacks.
+        @param callback Called from the reader thread with each Progress.
+        @param stall_timeout Kill ffmpeg if it sends no report for this many
+            seconds. Reports keep coming while it reads input, even when
+            filters such as mpdecimate hold back its output, so only a hung
+            process is killed.
+        """
+        if callback:
+            self.progress_callbacks.append(callback)
+        if stall_timeout:
+            self.stall_timeout = stall_timeout
+        self._updates = self._updates or queue.SimpleQueue()
+        return self
+
+    def updates(self) -> Iterator[Progress]:
+        """
+        Iterate over the progress reports until ffmpeg exits. Requires
+        progress() to have been called before start().
+        """
+        while (progress := self._updates.get()) is not None:
+            yield progress
+
+    def get_command(self, progress_fd: int | None = None):
         command = [self.command, '-y']
+        if progress_fd is not None:
+            command.extend(('-nostats', '-progress', f'pipe:{progress_fd}'))
         if self.loglevel:
             command.append('-loglevel')
             command.append(self.loglevel)
@@ -92,19 +177,95 @@ class Ffmpeg:
         command.append(self.output_file)
         return command
 
-    def start(self):
-        self.proc = subprocess.Popen(
-                self.get_command(),  stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL)
+    def start(self, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL):
+        """
+        Start ffmpeg without waiting for it.
+        @param stdout Pass subprocess.PIPE to read the output from proc.stdout
+            when the output file is pipe:1.
+        @param stderr Pass subprocess.PIPE to read the log from proc.stderr.
+        """
+        stats.count('subprocess.ffmpeg')
+        if self._updates is None:
+            self.proc = subprocess.Popen(
+                    self.get_command(),  stdout=stdout, stderr=stderr)
+            return
+        # progress goes to its own pipe, so stdout stays free for output
+        read_fd, write_fd = os.pipe()
+        try:
+            self.proc = subprocess.Popen(
+                    self.get_command(write_fd), stdout=stdout,
+                    stderr=stderr, pass_fds=(write_fd,))
+        except BaseException:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self.stalled = False
+        # the reports are made in the context of the thread starting ffmpeg,
+        # so that what they write goes wherever its output goes
+        self._progress_thread = threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._read_progress, read_fd, self.proc), daemon=True)
+        self._progress_thread.start()
+
+    def _read_progress(self, fd: int, proc: subprocess.Popen):
+        values = {}
+        buffer = b''
+        last_report = time.monotonic()
+        with os.fdopen(fd, 'rb', buffering=0) as pipe:
+            while True:
+                ready, _, _ = select.select([pipe], [], [], STALL_POLL)
+                if ready:
+                    data = pipe.read(4096)
+                    if not data:
+                        break
+                    buffer += data
+                    *lines, buffer = buffer.split(b'\n')
+                    for line in lines:
+                        key, _, value = line.decode('utf-8').partition('=')
+                        values[key.strip()] = value.strip()
+                        if key.strip() != 'progress':
+                            continue
+                        last_report = time.monotonic()
+                        self._report(Progress.parse(values))
+                if (self.stall_timeout and proc.poll() is None
+                        and time.monotonic() - last_report
+                        > self.stall_timeout):
+                    sys.stderr.write(f'ffmpeg made no progress for '
+                                     f'{self.stall_timeout} seconds, '
+                                     f'killing it\n')
+                    stats.count('ffmpeg.stalled')
+                    self.stalled = True
+                    proc.kill()
+                    break
+        if self.last_progress:
+            stats.count('ffmpeg.frames', self.last_progress.frame)
+        self._updates.put(None)
+
+    def _report(self, progress: Progress):
+        self.last_progress = progress
+        self._updates.put(progress)
+        for callback in self.progress_callbacks:
+            callback(progress)
 
     def wait(self):
+        """
+        Wait for ffmpeg to exit.
+        @throws Stalled if it was killed by the stall timeout.
+        """
         if self.proc:
             self.proc.wait()
+        if self._progress_thread:
+            self._progress_thread.join()
+            self._progress_thread = None
         self.proc = None
+        if self.stalled:
+            raise Stalled(f'{self.command} stalled on {self.output_file}')
 
     def is_running(self):
-        return self.proc.is_running()
+        return self.proc is not None and self.proc.poll() is None
 
+    @stats.timed('ffmpeg.run')
     def run(self):
         if not self.proc:
             self.start()
@@ -116,6 +277,7 @@ class _Ffmpeg_input:
         self.filename = filename
         self.file_format = file_format
         self.time_offset = 0
+        self.options = []
 
     def format(self, file_format):
         self.file_format = file_format
@@ -125,6 +287,13 @@ class _Ffmpeg_input:
         self.offset = offset
         return self
 
+    def extra_args(self, *args):
+        """
+        Options which apply to this input, placed before its -i.
+        """
+        self.options.extend(args)
+        return self
+
     def args(self):
         args = []
         if self.file_format:
@@ -133,6 +302,7 @@ class _Ffmpeg_input:
         if self.time_offset:
             args.append('-itsoffset')
             args.append(str(self.time_offset))
+        args.extend(self.options)
         args.append('-i')
         args.append(self.filename)
         return args
@@ -0,0 +1,125 @@
+"""
+A ring of frame buffers in shared memory, through which decoded frames reach
+the OCR pool without being pickled and copied through its pipes.
+
+The parent process owns a FrameRing: it takes a free slot, writes a frame
+into it, and hands the pool worker just a Slot, which names the ring and the
+place and size of the frame in it. The worker attaches to the ring once and
+reads the frame through a NumPy view on the shared memory. The slot is
+released when the task completes, and the parent then reuses it. Taking a
+slot blocks while all of them are in use, so a fast decoder can't run ahead
+of the OCR by more than the size of the ring.
+"""
+import sys
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from queue import SimpleQueue
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Slot:
+    """
+    A frame in a ring, which is all a pool task needs to find it.
+    """
+    name: str  # of the shared memory
+    index: int
+    shape: tuple[int, ...]  # height, width, and channels
+    time: float  # timestamp of the frame
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+
+class FrameRing:
+    """
+    args:
+        slots: The number of frames the ring holds.
+        shape: The (height, width, channels) of each frame, with one byte per
+            channel.
+    """
+    def __init__(self, slots: int, shape: tuple[int, ...]):
+        self.shape = tuple(shape)
+        self.slot_size = int(np.prod(self.shape))
+        self.memory = SharedMemory(create=True,
+                                   size=max(1, slots * self.slot_size))
+        _created.add(self.memory.name)
+        self.free = SimpleQueue()
+        for index in range(slots):
+            self.free.put(index)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def acquire(self) -> int:
+        """
+        Take a free slot, waiting for one to be released if there is none.
+        """
+        return self.free.get()
+
+    def release(self, index: int):
+        self.free.put(index)
+
+    def buffer(self, index: int) -> memoryview:
+        """
+        The writable memory of a slot. Release the memoryview when done with
+        it, the ring can't be closed while it is in use.
+        """
+        offset = index * self.slot_size
+        return self.memory.buf[offset:offset + self.slot_size]
+
+    def slot(self, index: int, time: float) -> Slot:
+        return Slot(self.name, index, self.shape, time)
+
+    def close(self):
+        _created.discard(self.name)
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# the rings created by this process
+_created: set[str] = set()
+# the ring a worker process is attached to. A worker only ever reads from the
+# ring of the current job, so attaching to a new one detaches from the last.
+_attached: dict[str, SharedMemory] = {}
+
+
+def _attach(name: str) -> SharedMemory:
+    memory = _attached.get(name)
+    if memory is None:
+        for old in _attached.values():
+            try:
+                old.close()
+            except BufferError:
+                pass  # a view of it is still alive, leave it to the GC
+        _attached.clear()
+        if sys.version_info >= (3, 13):
+            memory = SharedMemory(name, track=False)
+        else:
+            memory = SharedMemory(name)
+            if name not in _created:
+                # otherwise the worker's resource tracker unlinks the ring
+                # when the worker exits, and warns about it
+                resource_tracker.unregister(memory._name, 'shared_memory')
+        _attached[name] = memory
+    return memory
+
+
+def view(slot: Slot) -> np.ndarray:
+    """
+    The frame in a slot, as an array on the shared memory rather than a copy.
+    Only valid until the task it was handed to completes.
+    """
+    memory = _attach(slot.name)
+    return np.ndarray(slot.shape, np.uint8, memory.buf,
+                      slot.index * slot.size)
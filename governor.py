@@ -0,0 +1,169 @@
+"""
+Sizes the parallelism of each stage to the CPUs and memory this process may
+actually use, so that the OCR pool, the tesseract processes it starts and
+ffmpeg don't together run many more threads than there are cores.
+
+The CPUs are those in the affinity mask, further limited by a cgroup CPU
+quota (as set by docker --cpus or a systemd CPUQuota). The memory is what's
+available on the host, or the cgroup limit if that is lower.
+
+Each value can be overridden with an environment variable, which subexport
+also sets from its command line:
+    SUBCONVERT_WORKERS            OCR pool processes
+    SUBCONVERT_TESSERACT_JOBS     concurrent tesseract processes of the
+                                  asyncio OCR path
+    SUBCONVERT_TESSERACT_THREADS  OpenMP threads of each tesseract process,
+                                  also taken from OMP_THREAD_LIMIT
+    SUBCONVERT_FFMPEG_THREADS     threads of the extracting ffmpeg
+"""
+import math
+import os
+from dataclasses import dataclass
+from functools import cache
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# memory needed by one OCR worker and the tesseract process it runs, whose
+# LSTM models take most of it
+WORKER_MEMORY = 300 * 1024 * 1024
+
+
+@dataclass
+class Plan:
+    workers: int
+    tesseract_jobs: int
+    tesseract_threads: int
+    ffmpeg_threads: int
+
+    def __str__(self):
+        return (f'{self.workers} OCR workers, {self.tesseract_threads} '
+                f'thread(s) per tesseract, {self.ffmpeg_threads} ffmpeg '
+                f'threads')
+
+
+def _setting(name: str) -> int | None:
+    value = os.getenv(name, '').strip()
+    return int(value) if value.isdigit() and int(value) > 0 else None
+
+
+def _read(filename: str) -> str | None:
+    try:
+        with open(filename) as infile:
+            return infile.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_path() -> str:
+    """
+    The cgroup v2 directory of this process, relative to CGROUP_ROOT.
+    """
+    for line in (_read('/proc/self/cgroup') or '').splitlines():
+        if line.startswith('0::'):
+            return line[3:].lstrip('/')
+    return ''
+
+
+def _cgroup_file(root: str, name: str) -> str | None:
+    """
+    Read a cgroup v2 control file of this process, or of the root cgroup
+    when the process's own one isn't visible, as in most containers.
+    """
+    path = _cgroup_path()
+    value = _read(os.path.join(root, path, name)) if path else None
+    return value if value is not None else _read(os.path.join(root, name))
+
+
+def cgroup_cpu_limit(root: str = CGROUP_ROOT) -> float | None:
+    """
+    The number of CPUs the cgroup CPU quota allows, or None without one.
+    """
+    cpu_max = _cgroup_file(root, 'cpu.max')
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+        if quota != 'max':
+            return int(quota) / int(period or 100000)
+        return None
+    # cgroup v1
+    quota = _read(os.path.join(root, 'cpu', 'cpu.cfs_quota_us'))
+    period = _read(os.path.join(root, 'cpu', 'cpu.cfs_period_us'))
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def cgroup_memory_limit(root: str = CGROUP_ROOT) -> int | None:
+    """
+    The memory the cgroup may still use in bytes, or None without a limit.
+    """
+    limit = _cgroup_file(root, 'memory.max')
+    usage = _cgroup_file(root, 'memory.current')
+    if limit is None:
+        # cgroup v1, where no limit is a very large number
+        limit = _read(os.path.join(root, 'memory', 'memory.limit_in_bytes'))
+        usage = _read(os.path.join(root, 'memory', 'memory.usage_in_bytes'))
+        if limit and int(limit) >= 1 << 60:
+            limit = None
+    if not limit or limit == 'max':
+        return None
+    return max(0, int(limit) - int(usage or 0))
+
+
+def available_cpus() -> float:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_limit()
+    return min(cpus, quota) if quota else cpus
+
+
+def available_memory() -> int | None:
+    """
+    The available memory in bytes, or None if it can't be determined.
+    """
+    available = None
+    for line in (_read('/proc/meminfo') or '').splitlines():
+        if line.startswith('MemAvailable:'):
+            available = int(line.split()[1]) * 1024
+    limit = cgroup_memory_limit()
+    if limit is not None and (available is None or limit < available):
+        return limit
+    return available
+
+
+def make_plan(cpus: float, memory: int | None) -> Plan:
+    """
+    Work out the plan for the given resources, applying the overrides.
+
+    Tesseract gets one thread per process by default: a pool worker runs one
+    tesseract at a time, so with a worker per core each core runs one
+    single-threaded tesseract, which recognizes more lines per second than
+    OpenMP threads competing for the same cores. When there are fewer workers
+    than cores, the spare cores go to tesseract's threads.
+    """
+    cores = max(1, math.floor(cpus))
+    by_memory = max(1, memory // WORKER_MEMORY) if memory else cores
+    workers = _setting('SUBCONVERT_WORKERS') or min(cores, by_memory)
+    return Plan(
+            workers=workers,
+            tesseract_jobs=(_setting('SUBCONVERT_TESSERACT_JOBS')
+                            or min(cores, by_memory)),
+            tesseract_threads=(_setting('SUBCONVERT_TESSERACT_THREADS')
+                               or _setting('OMP_THREAD_LIMIT')
+                               or max(1, cores // workers)),
+            ffmpeg_threads=_setting('SUBCONVERT_FFMPEG_THREADS') or cores)
+
+
+@cache
+def plan() -> Plan:
+    """
+    The plan for this machine, worked out once per process.
+    """
+    return make_plan(available_cpus(), available_memory())
+
+
+def tesseract_env() -> dict[str, str]:
+    """
+    The environment tesseract is run with, limiting its OpenMP threads.
+    """
+    return {**os.environ, 'OMP_THREAD_LIMIT': str(plan().tesseract_threads)}
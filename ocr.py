@@ -1,23 +1,71 @@
 
+import asyncio
+import math
 import os
+import re
 import sys
+import threading
+import time
 import tesseract
 from typing import Iterator
+from collections import deque
 from dataclasses import dataclass
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing.pool import Pool
+from queue import SimpleQueue
 from shutil import which
-from PIL import Image, ImageOps
-
 import subprocess
 
+import numpy as np
+from PIL import Image, ImageChops, ImageOps
+
+import corrections
+import distributed
 import ffmpeg
+import framebuffer
+import governor
+import segment
+import stats
 from subtitles import Subtitles, SubtitleEntry
 
 FRAME_RATE = 10
 WORKDIR = '/tmp/work'
+# frames per second and downscaling of the subtitle region pre-scan
+SCAN_RATE = 2
+SCAN_SCALE = 4
+# padding around the detected subtitle region, relative to the frame height
+REGION_PADDING = 0.03
+# sampling rates of adaptive extraction: changes are found at the coarse rate
+# and their timing refined at the fine rate
+COARSE_RATE = 2
+FINE_RATE = 20
+# seconds decoded ahead of each refinement window in adaptive extraction
+ADAPTIVE_PREROLL = 10
+# seconds decoded ahead of each chunk in parallel extraction
+EXTRACT_OVERLAP = 10
+# seconds without new data before a followed recording is considered finished
+FOLLOW_TIMEOUT = 30
+# seconds between checks for new frames in follow mode
+FOLLOW_POLL = 0.5
+# finalized lines kept as context for normalize_values in follow mode
+FOLLOW_HISTORY = 200
+# frames held in shared memory per OCR worker by read_frames: the one it is
+# reading, and the next one
+RING_SLOTS_PER_WORKER = 2
+# the timestamp in ffmpeg's showinfo log line of a frame
+SHOWINFO_TIME = re.compile(rb'\bn:\s*\d+\s+pts:\s*-?\d+\s+pts_time:(\S+)')
+# frames whose brightest R, G and B values add up to less than this have no
+# text
+TEXT_BRIGHTNESS = 192
+# the brightest luma of a frame which extraction marks as empty, see
+# EmptyFrames. Black is 16, and subtitles are much brighter than this.
+EMPTY_LUMA = 20
+# the timestamp and the brightest luma in ffmpeg's log of a frame's metadata
+FRAME_LUMA = re.compile(rb'pts_time:(\S+)|signalstats\.YMAX=(\d+)')
 
 
+@distributed.serializable
 @dataclass
 class TextLine:
     start: float
@@ -70,33 +118,488 @@ def has_descenders(text):
 
 def getenv(name, default=None):
     val = os.getenv(name)
-    if val:
-        val = val.lower()
-        try:
-            val = int(val)
-        except ValueError:
-            pass
+    if not val:
+        return default
+    val = val.lower()
+    try:
+        val = int(val)
+    except ValueError:
+        pass
     return val
 
 
+def batch_size() -> int:
+    """
+    The number of images stacked into each tesseract call, set with
+    SUBCONVERT_BATCH. 1 (the default) disables batching.
+    """
+    return getenv('SUBCONVERT_BATCH', 1)
+
+
+def stall_timeout() -> int | None:
+    """
+    Seconds without a progress report from an extracting ffmpeg before it is
+    killed, set with SUBCONVERT_STALL_TIMEOUT. Unset (the default) never
+    kills it, and so does a value which isn't a whole number of seconds.
+    """
+    timeout = getenv('SUBCONVERT_STALL_TIMEOUT')
+    if timeout is not None and not isinstance(timeout, int):
+        sys.stderr.write(f'Ignoring SUBCONVERT_STALL_TIMEOUT={timeout}, '
+                         'which is not a whole number of seconds\n')
+        return None
+    return timeout
+
+
 def text_color(image: Image, x1: int, y1: int, x2: int, y2: int):
     cropped = image.crop((x1, y1, x2, y2))
     (_, r), (_, g), (_, b) = cropped.getextrema()
     return (r, g, b)
 
 
-def dump_subs(infile, stream, duration):
+def _extractor(infile, stream, duration=None, follow=False, output=WORKDIR,
+               seek=0, region=None, rate=FRAME_RATE, threads=None,
+               raw=False, luma=False) -> ffmpeg.Ffmpeg:
+    """
+    Set up the ffmpeg process which renders each change in the subtitle stream
+    to a png file. Without a duration, the frames follow the subtitle stream
+    until it ends.
+
+    args:
+        follow: Keep reading at the end of infile, which is still being
+            written, until no new data arrives for FOLLOW_TIMEOUT seconds.
+        output: The directory the frames are written to.
+        seek: Start reading infile at this time. Frame names are relative to
+            it.
+        region: Only write this (x, y, width, height) part of the frames.
+        rate: The frame rate the subtitles are sampled at. Frame names count
+            frames at this rate.
+        threads: The threads ffmpeg may use. Defaults to the governor's
+            ffmpeg_threads.
+        raw: Write the frames to stdout as rgb24 instead, and log the
+            timestamp of each to stderr, see read_frames.
+        luma: Log the brightest luma of each frame to stderr, see
+            EmptyFrames.
+    """
     width = stream['width']
     height = stream['height']
     st_index = stream['index']
 
-    ff = ffmpeg.Ffmpeg(f'{WORKDIR}/%06d.png').skip('audio')
-    ff.filter_complex(f"[1:v][0:{st_index}]overlay,mpdecimate")
+    ff = ffmpeg.Ffmpeg('pipe:1' if raw else f'{output}/%06d.png')
+    ff.skip('audio')
+    overlay = 'overlay' if duration else 'overlay=shortest=1'
+    if region:
+        x, y, w, h = region
+        overlay += f',crop={w}:{h}:{x}:{y}'
+    decimate = 'mpdecimate,showinfo' if raw else 'mpdecimate'
+    if luma:
+        decimate += (',signalstats,'
+                     'metadata=mode=print:key=lavfi.signalstats.YMAX')
+    ff.filter_complex(f"[1:v][0:{st_index}]{overlay},{decimate}")
+    source = ff.input(infile, None)
+    if seek:
+        source.extra_args('-ss', str(seek))
+    if follow and infile not in ('-', 'pipe:', 'pipe:0'):
+        source.extra_args('-follow', '1',
+                          '-rw_timeout', str(FOLLOW_TIMEOUT * 1000000))
+    color = f"color=size={width}x{height}:rate={rate}:color=black"
+    if duration:
+        color += f":duration={duration}"
+    ff.input(color, None).format('lavfi')
+    if raw:
+        ff.extra_args('-vsync', 'vfr', '-f', 'rawvideo', '-pix_fmt', 'rgb24')
+    else:
+        ff.extra_args('-vsync', 'vfr', '-frame_pts', '1')
+    ff.threads(threads or governor.plan().ffmpeg_threads)
+    if not follow:
+        # a followed input legitimately waits for new data
+        ff.progress(stall_timeout=stall_timeout())
+    return ff
+
+
+def _clock(seconds: float) -> str:
+    if not math.isfinite(seconds):
+        return '--:--:--'
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+class ExtractionProgress:
+    """
+    Writes the combined progress of the ffmpeg processes extracting the
+    subtitles to stderr, with their speed and the estimated time left.
+
+    The output time only advances when a frame is written, so it lags behind
+    during gaps in the subtitles and catches up at the next one.
+    """
+    def __init__(self, total: float):
+        self.total = total
+        self.done = {}
+        self.fps = {}
+        self.start = time.monotonic()
+        self.last_write = 0.0
+        self.lock = threading.Lock()
+        self.interval = 1 if sys.stderr.isatty() else 30
+
+    def watch(self, ff: ffmpeg.Ffmpeg, key=0):
+        ff.progress(lambda progress: self.update(key, progress))
+
+    def update(self, key, progress: ffmpeg.Progress):
+        with self.lock:
+            self.done[key] = progress.out_time
+            self.fps[key] = progress.fps
+            now = time.monotonic()
+            if now - self.last_write < self.interval:
+                return
+            self.last_write = now
+            done = min(sum(self.done.values()), self.total)
+            speed = done / (now - self.start)
+            eta = (self.total - done) / speed if speed else math.inf
+            end = '\r' if self.interval == 1 else '\n'
+            sys.stderr.write(f'Extracting: {_clock(done)} / '
+                             f'{_clock(self.total)} '
+                             f'({done / self.total:.1%}), '
+                             f'{sum(self.fps.values()):.0f} fps, '
+                             f'{speed:.1f}x, ETA {_clock(eta)}{end}')
+
+    def finish(self):
+        elapsed = max(time.monotonic() - self.start, 1e-3)
+        sys.stderr.write(f'Extracted {_clock(self.total)} in '
+                         f'{_clock(elapsed)} '
+                         f'({self.total / elapsed:.1f}x){" " * 30}\n')
+
+
+class EmptyFrames:
+    """
+    Marks the frames an extracting ffmpeg found to be empty, such as the
+    black frame mpdecimate keeps when a subtitle disappears, so that they
+    aren't sent to be OCRed. An empty frame is truncated to a zero length
+    file rather than removed, since its timestamp ends the subtitle before
+    it.
+
+    ffmpeg measures the brightest luma of each frame it writes, which it
+    logs to stderr (see _extractor's luma), and this reads that log while it
+    runs.
+
+    args:
+        ff: The extractor, made with luma=True and not started yet.
+        directory: The directory it writes the frames to.
+        rate: Its frame rate, which numbers the frames.
+    """
+    def __init__(self, ff: ffmpeg.Ffmpeg, directory: str = WORKDIR,
+                 rate: float = FRAME_RATE):
+        self.ff = ff
+        self.directory = directory
+        self.rate = rate
+        self.frames = []
+        self.thread = None
+
+    def start(self):
+        self.ff.start(stderr=subprocess.PIPE)
+        self.thread = threading.Thread(target=self._read_log,
+                                       args=(self.ff.proc.stderr,),
+                                       daemon=True)
+        self.thread.start()
+
+    def _read_log(self, log):
+        frame = None
+        with log:
+            for line in log:
+                if not (match := FRAME_LUMA.search(line)):
+                    continue
+                if match[1]:
+                    frame = round(float(match[1]) * self.rate)
+                elif frame is not None and int(match[2]) <= EMPTY_LUMA:
+                    self.frames.append(frame)
+
+    def mark(self):
+        """
+        Truncate the empty frames, once ffmpeg has exited.
+        """
+        self.thread.join()
+        for frame in self.frames:
+            image = f'{self.directory}/{frame:06d}.png'
+            if os.path.exists(image):
+                os.truncate(image, 0)
+        stats.count('frames.prefiltered', len(self.frames))
+
+
+def is_empty(image: str) -> bool:
+    """
+    Whether a frame was marked empty by EmptyFrames.
+    """
+    return os.path.getsize(image) == 0
+
+
+def frame_time(image: str | framebuffer.Slot, rate=FRAME_RATE) -> float:
+    """
+    The timestamp of an extracted frame from its file name. Frames are named
+    by their number at the rate they were extracted at, or by milliseconds
+    with an 'ms' suffix when their timing has been refined. A frame in shared
+    memory carries its timestamp.
+    """
+    if isinstance(image, framebuffer.Slot):
+        return image.time
+    name = os.path.basename(image)[:-4]
+    if name.endswith('ms'):
+        return int(name[:-2]) / 1000
+    return int(name) / rate
+
+
+def _same_image(image1: str, image2: str) -> bool:
+    if is_empty(image1) or is_empty(image2):
+        return is_empty(image1) and is_empty(image2)
+    with Image.open(image1) as img1, Image.open(image2) as img2:
+        return (img1.size == img2.size and ImageChops.difference(
+                img1.convert('RGB'), img2.convert('RGB')).getbbox() is None)
+
+
+def _stitch_chunks(chunks: list[tuple[str, float, float]]):
+    """
+    Move the frames extracted for each time chunk into WORKDIR, named by
+    their position on the global timeline. Frames from the overlap decoded
+    before a chunk's start are dropped, as is the first frame of a chunk when
+    it repeats the last frame of the previous one.
+
+    args:
+        chunks: (directory, seek, start) for each chunk, in order.
+    """
+    last = None
+    for directory, seek, start in chunks:
+        first = True
+        for image in sorted(glob(f'{directory}/*.png')):
+            frame = round((seek + frame_time(image)) * FRAME_RATE)
+            if (frame < start * FRAME_RATE
+                    or (first and last and _same_image(last, image))):
+                os.remove(image)
+                continue
+            first = False
+            last = f'{WORKDIR}/{frame:06d}.png'
+            os.rename(image, last)
+        os.rmdir(directory)
+
+
+def find_region(infile, stream, duration) -> tuple[int, int, int, int] | None:
+    """
+    Find the part of the frame subtitles are shown in, by quickly rendering
+    the subtitle stream at SCAN_RATE fps and 1/SCAN_SCALE size and taking the
+    union of all bright pixels.
+
+    returns:
+        The (x, y, width, height) of the region, padded by REGION_PADDING of
+        the frame height, or None if no subtitles were seen.
+    """
+    width = stream['width']
+    height = stream['height']
+    scan_width = width // SCAN_SCALE
+    scan_height = height // SCAN_SCALE
+
+    ff = ffmpeg.Ffmpeg('pipe:1').skip('audio')
+    ff.filter_complex(f"[0:{stream['index']}]scale={scan_width}:{scan_height}"
+                      f"[subs];[1:v][subs]overlay,format=gray")
     ff.input(infile, None)
-    ff.input(f"color=size={width}x{height}:rate={FRAME_RATE}:color=black"
-             f":duration={duration}", None).format('lavfi')
-    ff.extra_args('-vsync', 'vfr', '-frame_pts', '1')
+    ff.input(f"color=size={scan_width}x{scan_height}:rate={SCAN_RATE}"
+             f":color=black:duration={duration}", None).format('lavfi')
+    ff.extra_args('-f', 'rawvideo')
+    ff.threads(governor.plan().ffmpeg_threads)
+    seen = np.zeros((scan_height, scan_width), dtype=np.uint8)
+    frame_size = scan_width * scan_height
+    with stats.timer('find_region'):
+        ff.start(stdout=subprocess.PIPE)
+        while len(data := ff.proc.stdout.read(frame_size)) == frame_size:
+            np.maximum(seen, np.frombuffer(data, np.uint8).reshape(
+                    scan_height, scan_width), out=seen)
+        ff.proc.stdout.close()
+        ff.wait()
+
+    ys, xs = np.nonzero(seen > segment.THRESHOLD)
+    if not len(ys):
+        return None
+    pad = int(height * REGION_PADDING)
+    # keep the crop aligned to even pixels for ffmpeg
+    x1 = max(0, int(xs.min()) * SCAN_SCALE - pad) // 2 * 2
+    y1 = max(0, int(ys.min()) * SCAN_SCALE - pad) // 2 * 2
+    x2 = min(width, (int(xs.max()) + 1) * SCAN_SCALE + pad)
+    y2 = min(height, (int(ys.max()) + 1) * SCAN_SCALE + pad)
+    return x1, y1, (x2 - x1) // 2 * 2, (y2 - y1) // 2 * 2
+
+
+def dump_subs(infile, stream, duration, jobs=1, region=None):
+    """
+    Render the subtitle stream to png files in WORKDIR.
+
+    args:
+        jobs: Split the input into this many time chunks which are extracted
+            by parallel ffmpeg processes. Each chunk starts decoding
+            EXTRACT_OVERLAP seconds early so that subtitles already showing
+            at its start are rendered.
+        region: Only write this (x, y, width, height) part of the frames.
+    """
+    if jobs <= 1:
+        ff = _extractor(infile, stream, duration, region=region, luma=True)
+        progress = ExtractionProgress(duration)
+        progress.watch(ff)
+        empty = EmptyFrames(ff)
+        empty.start()
+        with stats.timer('ffmpeg.run'):
+            ff.wait()
+        progress.finish()
+        empty.mark()
+        return
+    chunk = math.ceil(duration / jobs)
+    chunks = []
+    extractors = []
+    for n in range(jobs):
+        start = n * chunk
+        if start >= duration:
+            break
+        end = min(start + chunk, duration)
+        seek = max(0, start - EXTRACT_OVERLAP)
+        directory = f'{WORKDIR}/chunk{n:03d}'
+        os.makedirs(directory, exist_ok=True)
+        # the chunks share the threads
+        ff = _extractor(infile, stream, end - seek, output=directory,
+                        seek=seek, region=region,
+                        threads=max(1, governor.plan().ffmpeg_threads // jobs),
+                        luma=True)
+        chunks.append((directory, seek, start))
+        extractors.append((ff, end - seek, EmptyFrames(ff, directory)))
+    # the overlaps are decoded twice, so they count towards the total
+    progress = ExtractionProgress(sum(length for _, length, _ in extractors))
+    for n, (ff, _, empty) in enumerate(extractors):
+        progress.watch(ff, n)
+        empty.start()
+    with stats.timer('ffmpeg.run'):
+        try:
+            for ff, _, _ in extractors:
+                ff.wait()
+        except ffmpeg.Stalled:
+            for ff, _, _ in extractors:
+                if ff.is_running():
+                    ff.proc.kill()
+            raise
+    progress.finish()
+    for _, _, empty in extractors:
+        empty.mark()
+    _stitch_chunks(chunks)
+
+
+def _window_frames(infile, stream, seek: float, start: float, end: float,
+                   rate: int, region=None) -> list[np.ndarray]:
+    """
+    Render the subtitles between start and end at the given rate as rgb
+    arrays. Reading starts at seek, so that subtitles already showing at
+    start are decoded, but only frames from start on are overlaid.
+    """
+    width = stream['width']
+    height = stream['height']
+    crop = ''
+    if region:
+        x, y, width, height = region
+        crop = f',crop={width}:{height}:{x}:{y}'
+    ff = ffmpeg.Ffmpeg('pipe:1').skip('audio')
+    ff.filter_complex(f"[1:v]trim=start={start - seek}[base];"
+                      f"[base][0:{stream['index']}]overlay{crop}")
+    ff.input(infile, None).extra_args('-ss', str(seek))
+    ff.input(f"color=size={stream['width']}x{stream['height']}:rate={rate}"
+             f":color=black:duration={end - seek + 0.5 / rate}",
+             None).format('lavfi')
+    ff.extra_args('-vsync', 'passthrough', '-f', 'rawvideo',
+                  '-pix_fmt', 'rgb24')
+    ff.threads(1)
+    frame_size = width * height * 3
+    frames = []
+    ff.start(stdout=subprocess.PIPE)
+    while len(data := ff.proc.stdout.read(frame_size)) == frame_size:
+        frames.append(np.frombuffer(data, np.uint8).reshape(height, width, 3))
+    ff.proc.stdout.close()
+    ff.wait()
+    return frames
+
+
+def _refine_change(infile, stream, image: str, sample_time: float,
+                   coarse_rate: int, fine_rate: int, region=None) -> float:
+    """
+    Find when the change shown in a coarse frame happened. It happened after
+    the previous coarse sample, so the frames in between are rendered at the
+    fine rate, and the first one that looks like the coarse frame is found by
+    binary search.
+
+    returns:
+        The refined time, or the coarse time if no frame matched.
+    """
+    start = sample_time - 1 / coarse_rate
+    # seek to a whole number of fine frames so the frame times line up
+    seek = max(0, math.floor((start - ADAPTIVE_PREROLL) * fine_rate)
+               / fine_rate)
+    first = math.ceil(round((start - seek) * fine_rate, 6))
+    frames = _window_frames(infile, stream, seek, start, sample_time,
+                            fine_rate, region)
+    with Image.open(image) as img:
+        target = np.asarray(img.convert('RGB'))
+    if not frames or frames[0].shape != target.shape:
+        return sample_time
+
+    def changed(frame):
+        return (np.count_nonzero(frame != target)
+                < np.count_nonzero(frame != frames[0]))
+
+    low, high = 0, len(frames)
+    while low < high:
+        mid = (low + high) // 2
+        if changed(frames[mid]):
+            high = mid
+        else:
+            low = mid + 1
+    if low == len(frames):
+        return sample_time
+    return seek + (first + low) / fine_rate
+
+
+def dump_subs_adaptive(infile, stream, duration, region=None,
+                       coarse_rate=COARSE_RATE, fine_rate=FINE_RATE):
+    """
+    Render the subtitle stream to png files in WORKDIR, sampling it at a
+    coarse rate to find where it changes and then refining the time of each
+    change at the fine rate. The frames are named by their refined time in
+    milliseconds.
+
+    Changes which come and go between two coarse samples are missed, so
+    coarse_rate should stay above the shortest subtitle duration.
+    """
+    directory = f'{WORKDIR}/coarse'
+    os.makedirs(directory, exist_ok=True)
+    ff = _extractor(infile, stream, duration, output=directory,
+                    region=region, rate=coarse_rate)
+    progress = ExtractionProgress(duration)
+    progress.watch(ff)
     ff.run()
+    progress.finish()
+    images = sorted(glob(f'{directory}/*.png'))
+    sample_times = [frame_time(image, coarse_rate) for image in images]
+    # each window is rendered by a single threaded ffmpeg
+    with (stats.timer('refine_changes'),
+          ThreadPoolExecutor(governor.plan().ffmpeg_threads) as executor):
+        refined = list(executor.map(
+                lambda image, sample_time: _refine_change(
+                    infile, stream, image, sample_time, coarse_rate,
+                    fine_rate, region) if sample_time > 0 else 0.0,
+                images, sample_times))
+    stats.count('frames.refined', len(images))
+    for image, change_time in zip(images, refined):
+        os.rename(image, f'{WORKDIR}/{round(change_time * 1000):09d}ms.png')
+    os.rmdir(directory)
+
+
+def line_color(image: Image, bbox: tuple[int, int, int, int]
+               ) -> tuple[int, int, int]:
+    """
+    Find the most frequent color that's not dark inside bbox.
+    """
+    cropped = image.crop(bbox)
+    colors = [c for c in cropped.getdata() if sum(c) >= 400]
+    sorted_colors = sorted([c for c in set(colors)], key=colors.count,
+                           reverse=True)
+    return sorted_colors[0]
 
 
 def fix_common(text: str | tesseract.Line | tesseract.Word):
@@ -124,6 +627,7 @@ class SpellChecker:
     def __init__(self):
         self.checker = which('ispell')
 
+    @stats.timed('SpellChecker.check')
     def check(self, detection_list):
         """
         This all looks super complicated, so let me explain:
@@ -146,11 +650,10 @@ class SpellChecker:
         if not self.checker:
             return ' '.join(w[0] for w in words)
 
-        def strip(word):
-            return ''.join(c for c in word if c.isalpha() or c in "'-")
         # join this all together and strip out any non-word characters
-        # isalpha() should also work on all non-english characters
-        spell_input = '\n'.join(' '.join(strip(w) for w in x) for x in words)
+        spell_input = '\n'.join(' '.join(self._strip(w) for w in x)
+                                for x in words)
+        stats.count('subprocess.ispell')
         spell = subprocess.Popen([self.checker, '-a', '-W0'],
                                  stdin=subprocess.PIPE,
                                  stdout=subprocess.PIPE,
@@ -168,43 +671,238 @@ class SpellChecker:
                 final_string.append(line[0])
         return ' '.join(final_string)
 
+    @staticmethod
+    def _strip(word: str) -> str:
+        # isalpha() should also work on all non-english characters
+        return ''.join(c for c in word if c.isalpha() or c in "'-")
+
+    @stats.timed('SpellChecker.spelled')
+    def spelled(self, words: list[str]) -> list[bool]:
+        """
+        Whether ispell accepts each of the words, as check would find them.
+        A word with nothing left to check once stripped isn't accepted.
+        """
+        stripped = [self._strip(w) for w in words]
+        checked = [w for w in stripped if w]
+        if not checked:
+            return [False] * len(words)
+        stats.count('subprocess.ispell')
+        spell = subprocess.Popen([self.checker, '-a', '-W0'],
+                                 stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL)
+        # one word per line, each escaped with ^ so that it isn't taken for
+        # a command
+        out, _ = spell.communicate('\n'.join(f'^{w}' for w in checked)
+                                   .encode('utf-8'))
+        # the first line is ispell's version, then a result for each line
+        # followed by an empty line
+        results = iter(out.decode('utf-8').split('\n', 1)[-1]
+                       .split('\n\n'))
+        return [bool(w) and next(results, '')[:1] in ('*', '+')
+                for w in stripped]
+
+
+def _verify_variants(cropped: tuple[Image]) -> list[tuple[Image, int]]:
+    """
+    The extra readings used to break a tie between the two engines, as
+    (image, oem) pairs: the default engine on the full crop, then both
+    engines at 0.75 and 0.5 scale. Each scale of a crop is made once, and
+    read by both engines.
+    """
+    scaled = [c.resize((int(c.width * 0.75),
+              int(c.height * 0.75))) for c in cropped]
+    half = [c.reduce(2) for c in cropped]
+    return [(cropped[1], 3), (scaled[1], 1), (scaled[0], 0),
+            (half[1], 1), (half[0], 0)]
+
+
+class Vote:
+    """
+    Works out what SpellChecker.check will make of all the readings of a
+    line before they are all in, so that the remaining ones need not be
+    read.
+
+    The result is decided once a strict majority of all the readings have
+    the same number of words, so the median check takes is known, and at
+    each word the most frequent one leads by more than the readings still
+    to come. With ispell, those words must also be spelled correctly, since
+    check skips the misspelled ones for any correct word a later reading may
+    bring. This gives the same result as check on all the readings.
+
+    args:
+        total: The number of readings there will be.
+        checker: The SpellChecker the result is decided with.
+    """
+    def __init__(self, total: int, checker: SpellChecker | None = None):
+        self.total = total
+        self.checker = checker or SpellChecker()
+        self.readings = {}  # their position in the order of the readings
+
+    def add(self, index: int, text: str):
+        self.readings[index] = text
+
+    def _texts(self) -> list[str]:
+        return [self.readings[i] for i in sorted(self.readings)]
+
+    def majority(self) -> str | None:
+        """
+        The most frequent words, if the remaining readings can't change
+        them.
+        """
+        texts = self._texts()
+        remaining = self.total - len(texts)
+        spaces = [t.count(' ') for t in texts]
+        median = max(set(spaces), key=spaces.count)
+        if spaces.count(median) <= self.total // 2:
+            return None
+        leaders = []
+        for words in zip(*(t.split() for t in texts
+                           if t.count(' ') == median)):
+            counts = sorted((words.count(w) for w in set(words)),
+                            reverse=True) + [0]
+            if counts[0] <= counts[1] + remaining:
+                return None
+            leaders.append(max(words, key=words.count))
+        return ' '.join(leaders)
+
+    def decide(self) -> str | None:
+        """
+        The result, or None if the remaining readings could still change
+        it. Runs ispell when the words have a majority.
+        """
+        if len(self.readings) == self.total:
+            return self.checker.check(self._texts())
+        leaders = self.majority()
+        if leaders is None or not self.checker.checker:
+            return leaders
+        if not all(self.checker.spelled(leaders.split())):
+            return None
+        return leaders
+
+
+async def _vote(text0: str, text1: str, cropped: tuple[Image]) -> str:
+    """
+    Read the variants of a line at the same time, and vote on the readings
+    as they come in. The readings still running when the Vote is decided
+    are cancelled, which kills their tesseract processes.
+    """
+    variants = _verify_variants(cropped)
+    vote = Vote(2 + len(variants))
+    vote.add(0, text0)
+    vote.add(1, text1)
+    tasks = {asyncio.create_task(tesseract.simple_read_async(image, oem=oem)):
+             n for n, (image, oem) in enumerate(variants, 2)}
+    pending = set(tasks)
+    try:
+        while (result := await asyncio.to_thread(vote.decide)) is None:
+            done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                vote.add(tasks[task], task.result())
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    stats.count('verify.cancelled', len(pending))
+    return result
+
+
+def _known_correction(text0: str, text1: str) -> str | None:
+    """
+    Resolve a disagreement from the correction store, if one is configured
+    and knows every token pair involved.
+    """
+    store = corrections.store()
+    if not store:
+        return None
+    result = store.resolve(text0, text1)
+    if result is not None:
+        stats.count('lines.corrected')
+        sys.stderr.write(f'Known: {text0} | {text1} -> {result}\n')
+    return result
+
 
+def _learn_correction(text0: str, text1: str, result: str):
+    store = corrections.store()
+    if store:
+        store.learn(text0, text1, result)
+
+
+@stats.timed('verify_text')
 def verify_text(text0: str, text1: str, cropped: tuple[Image]):
+    """
+    Settle a disagreement between the two engines by reading the line
+    again in other ways (see _verify_variants) and voting. The variants are
+    read at the same time, and the rest are cancelled as soon as the Vote
+    is decided.
+    """
     if text0 == text1:
         return text0
-    detected = [text0, text1]
+    if (known := _known_correction(text0, text1)) is not None:
+        return known
+    stats.count('lines.escalated')
     sys.stderr.write(f'Checking: {text0} | {text1}\n')
-    detected.append(tesseract.simple_read(cropped[1], oem=3))
+    if batch_size() > 1:
+        detected = [text0, text1]
+        variants = _verify_variants(cropped)
+        detected.append(tesseract.simple_read(*variants[0]))
+        # read both scales of each engine in a single tesseract call
+        text_oem1 = tesseract.simple_read_batch(
+                [variants[1][0], variants[3][0]], oem=1)
+        text_oem0 = tesseract.simple_read_batch(
+                [variants[2][0], variants[4][0]], oem=0)
+        detected.extend((text_oem1[0], text_oem0[0],
+                         text_oem1[1], text_oem0[1]))
+        result = SpellChecker().check(detected)
+    else:
+        result = asyncio.run(_vote(text0, text1, cropped))
+    sys.stderr.write(f'{text1} -> {result}\n')
+    _learn_correction(text0, text1, result)
+    return result
 
-    scaled = [c.resize((int(c.width * 0.75),
-              int(c.height * 0.75))) for c in cropped]
-    detected.append(tesseract.simple_read(scaled[1], oem=1))
-    detected.append(tesseract.simple_read(scaled[0], oem=0))
 
-    scaled = [c.reduce(2) for c in cropped]
-    detected.append(tesseract.simple_read(scaled[1], oem=1))
-    detected.append(tesseract.simple_read(scaled[0], oem=0))
-    result = SpellChecker().check(detected)
+@stats.timed('verify_text_async')
+async def verify_text_async(text0: str, text1: str, cropped: tuple[Image]):
+    """
+    The asyncio version of verify_text.
+    """
+    if text0 == text1:
+        return text0
+    if (known := _known_correction(text0, text1)) is not None:
+        return known
+    stats.count('lines.escalated')
+    sys.stderr.write(f'Checking: {text0} | {text1}\n')
+    result = await _vote(text0, text1, cropped)
     sys.stderr.write(f'{text1} -> {result}\n')
+    _learn_correction(text0, text1, result)
     return result
 
 
-def read_image(image: str) -> Iterator[TextLine]:
+def _open_frame(image: str | framebuffer.Slot
+                ) -> tuple[Image.Image, ...] | None:
     """
-    Reads the text in an image and returns a list of lines in the format:
-        timestamp, text, size, marginR, marginL, marginBottom, and text color
-
-    args:
-        image: The path to the image
+    Load a frame along with the grayscale and inverted images that are fed to
+    tesseract. Returns None if there is no text in the frame.
     """
-    pil_img = Image.open(image)
+    stats.count('frames.processed')
+    if isinstance(image, framebuffer.Slot):
+        # made from the shared memory with one copy: Pillow only shares
+        # memory with arrays of 1 and 4 byte pixels
+        pil_img = Image.fromarray(framebuffer.view(image), 'RGB')
+    else:
+        pil_img = Image.open(image)
     tess0_img = ImageOps.grayscale(pil_img)
     tess1_img = ImageOps.invert(tess0_img)
     (_, r), (_, g), (_, b) = pil_img.getextrema()
-    if sum((r, g, b)) < 192:  # there's no text here
-        return []
-    lines0 = tesseract.read_image(tess0_img, oem=0)
-    lines1 = tesseract.read_image(tess1_img, oem=1)
+    if sum((r, g, b)) < TEXT_BRIGHTNESS:  # there's no text here
+        stats.count('frames.empty')
+        return None
+    return pil_img, tess0_img, tess1_img
+
+
+def _match_lines(lines0: list[tesseract.Line], lines1: list[tesseract.Line]
+                 ) -> list[tuple[tesseract.Line, tesseract.Line]]:
     # check for a mismatch in the number of lines detected.
     # in practice this should never happen, but...
     match cmp := len(lines0) - len(lines1):
@@ -216,42 +914,273 @@ def read_image(image: str) -> Iterator[TextLine]:
         case _ if cmp > 0:
             sys.stderr.write('ERROR: LINE COUNT MISMATCH!\n')
             lines1 = lines0
+    return list(zip(lines0, lines1))
+
+
+def _verify_args(frame: tuple[Image.Image, ...], line0: tesseract.Line,
+                 line1: tesseract.Line) -> tuple[str, str, tuple[Image]]:
+    """
+    The arguments for verify_text: both readings of a line and the crops of
+    that line from the grayscale and inverted frame.
+    """
+    _, tess0_img, tess1_img = frame
+    x1, y1, x2, y2 = line0.bbox
+    verify_img = (tess0_img.crop((x1-10, y1-10, x2+10, y2+10)),
+                  tess1_img.crop((x1-10, y1-10, x2+10, y2+10)))
+    return fix_common(line0), fix_common(line1), verify_img
 
-    start_time = int(image[-10:-4]) / FRAME_RATE
+
+def _text_line(image: str | framebuffer.Slot,
+               frame: tuple[Image.Image, ...], line0: tesseract.Line,
+               line1: tesseract.Line, text: str,
+               region: tuple[int, int, int, int] | None = None,
+               frame_size: tuple[int, int] | None = None) -> TextLine:
+    pil_img = frame[0]
+    x1, y1, x2, y2 = line0.bbox
+    # margins are relative to the full frame, even if only a region of it
+    # was extracted
+    offset_x, offset_y = region[:2] if region else (0, 0)
+    width, height = frame_size or pil_img.size
+    marginr = width - (x2 + offset_x)
+    reduce_margin = min(x1 + offset_x, marginr)
+    marginl = x1 + offset_x - reduce_margin
+    marginr -= reduce_margin
+    marginv = (height - (y2 + offset_y))
+
+    size = line1.size * 1.5
+#      sys.stderr.write(f"Size: {line1.size} -> {line1}\n")
+    if has_descenders(text):
+        marginv -= int(size * 0.05)
+    else:
+        marginv -= int(size * 0.3)
+    color = line_color(pil_img, line0.bbox)
+    if color[0] == 1 and isinstance(image, str):
+        pil_img.crop((x1, y1, x2, y2)).save(image.replace('work', 'cropped'))
+    start_time = frame_time(image)
+    return TextLine(start_time, text, size, line0.italic, line0.bold,
+                    marginl, marginr, marginv, color)
+
+
+def _text_lines(image: str | framebuffer.Slot,
+                frame: tuple[Image.Image, ...],
+                lines0: list[tesseract.Line], lines1: list[tesseract.Line],
+                region: tuple[int, int, int, int] | None = None,
+                frame_size: tuple[int, int] | None = None
+                ) -> list[TextLine]:
+    """
+    Turn the lines read by both tesseract engines into TextLines, verifying
+    the text wherever the engines disagree.
+    """
     results = []
-    for line0, line1 in zip(lines0, lines1):
-        x1, y1, x2, y2 = line0.bbox
-        marginr = pil_img.width - x2
-        reduce_margin = min(x1, marginr)
-        marginl = x1 - reduce_margin
-        marginr -= reduce_margin
-        marginv = (pil_img.height - y2)
-        text0 = fix_common(line0)
-        text1 = fix_common(line1)
-        verify_img = (tess0_img.crop((x1-10, y1-10, x2+10, y2+10)),
-                      tess1_img.crop((x1-10, y1-10, x2+10, y2+10)))
+    escalated = False
+    for line0, line1 in _match_lines(lines0, lines1):
+        text0, text1, verify_img = _verify_args(frame, line0, line1)
+        escalated = escalated or text0 != text1
         text = verify_text(text0, text1, verify_img)
+        results.append(_text_line(image, frame, line0, line1, text, region,
+                                  frame_size))
+    if escalated:
+        stats.count('frames.escalated')
+    return results
 
-        size = line1.size * 1.5
-#          sys.stderr.write(f"Size: {line1.size} -> {text1}\n")
-        if has_descenders(text):
-            marginv -= int(size * 0.05)
-        else:
-            marginv -= int(size * 0.3)
-        # find the most frequent color that's not dark
-        cropped = pil_img.crop((x1, y1, x2, y2))
-        colors = [c for c in cropped.getdata() if sum(c) >= 400]
-        sorted_colors = sorted([c for c in set(colors)], key=colors.count,
-                               reverse=True)
-        if sorted_colors[0][0] == 1:
-            cropped.save(image.replace('work', 'cropped'))
-        results.append(TextLine(start_time, text, size, line0.italic,
-                                line0.bold, marginl, marginr,
-                                marginv, sorted_colors[0]))
+
+def _line_boxes(frame: tuple[Image.Image, ...],
+                padding: int = 10) -> list[tesseract.Bbox]:
+    """
+    The boxes to crop each line of text from a frame for single line
+    recognition, with some padding so tesseract sees a margin around the
+    text.
+    """
+    _, tess0_img, _ = frame
+    return [tesseract.Bbox(max(0, x1 - padding), max(0, y1 - padding),
+                           min(tess0_img.width, x2 + padding),
+                           min(tess0_img.height, y2 + padding))
+            for x1, y1, x2, y2 in segment.find_lines(tess0_img)]
+
+
+def _place_lines(boxes: list[tesseract.Bbox],
+                 lines: list[tuple[tesseract.Line | None, ...]]
+                 ) -> tuple[list[tesseract.Line], list[tesseract.Line]]:
+    """
+    Move the lines read from each crop back into frame coordinates. When only
+    one engine found text in a crop its line is used for both, so both
+    engines always return the same number of lines.
+    """
+    lines0 = []
+    lines1 = []
+    for (x, y, _, _), (line0, line1) in zip(boxes, lines):
+        for line in (line0, line1):
+            if line:
+                line.translate(x, y)
+        if not line0 and not line1:
+            continue
+        lines0.append(line0 or line1)
+        lines1.append(line1 or line0)
+    return lines0, lines1
+
+
+@stats.timed('ocr.read_image')
+def read_image(image: str | framebuffer.Slot,
+               region: tuple[int, int, int, int] | None = None,
+               frame_size: tuple[int, int] | None = None
+               ) -> Iterator[TextLine]:
+    """
+    Reads the text in an image and returns a list of lines in the format:
+        timestamp, text, size, marginR, marginL, marginBottom, and text color
+
+    args:
+        image: The path to the image, or its slot in a framebuffer.FrameRing
+        region: The (x, y, width, height) of the image in the full frame, if
+            only a region of the frame was extracted.
+        frame_size: The (width, height) of the full frame, which the margins
+            are relative to. Defaults to the size of the image.
+    """
+    frame = _open_frame(image)
+    if not frame:
+        return []
+    _, tess0_img, tess1_img = frame
+    if getenv('SUBCONVERT_SEGMENT', 1):
+        boxes = _line_boxes(frame)
+        lines = [(tesseract.read_line(tess0_img.crop(box), oem=0),
+                  tesseract.read_line(tess1_img.crop(box), oem=1))
+                 for box in boxes]
+        lines0, lines1 = _place_lines(boxes, lines)
+    else:
+        lines0 = tesseract.read_image(tess0_img, oem=0)
+        lines1 = tesseract.read_image(tess1_img, oem=1)
+    return _text_lines(image, frame, lines0, lines1, region, frame_size)
+
+
+@stats.timed('ocr.read_image_async')
+async def read_image_async(image: str,
+                           region: tuple[int, int, int, int] | None = None,
+                           frame_size: tuple[int, int] | None = None
+                           ) -> list[TextLine]:
+    """
+    The asyncio version of read_image. Both engine passes run at the same
+    time, followed by the verification of all lines in the frame.
+    """
+    frame = _open_frame(image)
+    if not frame:
+        return []
+    _, tess0_img, tess1_img = frame
+    if getenv('SUBCONVERT_SEGMENT', 1):
+        boxes = _line_boxes(frame)
+        lines = await asyncio.gather(*(asyncio.gather(
+                tesseract.read_line_async(tess0_img.crop(box), oem=0),
+                tesseract.read_line_async(tess1_img.crop(box), oem=1))
+                for box in boxes))
+        lines0, lines1 = _place_lines(boxes, lines)
+    else:
+        lines0, lines1 = await asyncio.gather(
+                tesseract.read_image_async(tess0_img, oem=0),
+                tesseract.read_image_async(tess1_img, oem=1))
+    pairs = _match_lines(lines0, lines1)
+    verify_args = [_verify_args(frame, *pair) for pair in pairs]
+    if any(text0 != text1 for text0, text1, _ in verify_args):
+        stats.count('frames.escalated')
+    texts = await asyncio.gather(*(verify_text_async(*args)
+                                   for args in verify_args))
+    return [_text_line(image, frame, line0, line1, text, region, frame_size)
+            for (line0, line1), text in zip(pairs, texts)]
+
+
+async def _read_images_async(images: list[str],
+                             region: tuple[int, int, int, int] | None = None,
+                             frame_size: tuple[int, int] | None = None
+                             ) -> list[list[TextLine]]:
+    """
+    Read all images in a single event loop. The number of frames in flight
+    is bounded so that tesseract always has work queued without holding every
+    decoded frame in memory.
+    """
+    in_flight = asyncio.Semaphore(governor.plan().tesseract_jobs * 2)
+
+    async def read(image):
+        async with in_flight:
+            return await read_image_async(image, region, frame_size)
+    return await asyncio.gather(*(read(image) for image in images))
+
+
+def text_bbox(image: Image.Image, padding: int = 10
+              ) -> tuple[int, int, int, int] | None:
+    """
+    The bounding box of the bright pixels in a grayscale frame, with some
+    padding so tesseract sees a margin around the text. None if no pixel is
+    bright enough, as in a frame with only dark colored pixels.
+    """
+    bbox = image.point(lambda v: 255 if v > 32 else 0).getbbox()
+    if bbox is None:
+        return None
+    x1, y1, x2, y2 = bbox
+    return (max(0, x1 - padding), max(0, y1 - padding),
+            min(image.width, x2 + padding), min(image.height, y2 + padding))
+
+
+@stats.timed('ocr.read_images')
+def read_images(images: list[str],
+                region: tuple[int, int, int, int] | None = None,
+                frame_size: tuple[int, int] | None = None
+                ) -> list[list[TextLine]]:
+    """
+    Like read_image, but reads a batch of frames with a single tesseract call
+    per engine. Each frame is cropped to its text and the crops are stacked
+    into one montage.
+
+    args:
+        images: The paths to the images
+        region, frame_size: See read_image.
+    """
+    frames = {i: frame for i, image in enumerate(images)
+              if (frame := _open_frame(image))}
+    crops = {i: crop for i, frame in frames.items()
+             if (crop := text_bbox(frame[1]))}
+    # frames without a bright enough pixel to crop to have no text either
+    frames = {i: frames[i] for i in crops}
+    results = [[] for _ in images]
+    if not frames:
+        return results
+    batch0 = tesseract.read_batch(
+            [frames[i][1].crop(crops[i]) for i in frames], oem=0)
+    batch1 = tesseract.read_batch(
+            [frames[i][2].crop(crops[i]) for i in frames], oem=1)
+    for i, lines0, lines1 in zip(frames, batch0, batch1):
+        x, y, _, _ = crops[i]
+        for line in lines0 + lines1:
+            line.translate(x, y)
+        results[i] = _text_lines(images[i], frames[i], lines0, lines1,
+                                 region, frame_size)
     return results
 
 
-def read_subs(directory) -> Iterator[TextLine]:
+@distributed.task
+def _read_image_stats(image: str | framebuffer.Slot, region=None,
+                      frame_size=None) -> tuple[list[TextLine], dict]:
+    """
+    Runs read_image in a pool worker and hands the worker's instrumentation
+    back along with the result.
+    """
+    return read_image(image, region, frame_size), stats.snapshot(reset=True)
+
+
+@distributed.task
+def _read_images_stats(images: list[str], region=None, frame_size=None
+                       ) -> tuple[list[list[TextLine]], dict]:
+    return (read_images(images, region, frame_size),
+            stats.snapshot(reset=True))
+
+
+def read_subs(directory, region=None, pool=None, frame_size=None
+              ) -> Iterator[TextLine]:
+    """
+    OCR the frames in directory and yield their lines in timestamp order.
+
+    args:
+        region, frame_size: See read_image.
+        pool: Runs the OCR of each frame or batch of frames. Anything with
+            the apply_async of a multiprocessing Pool will do, such as a
+            distributed.Coordinator. Defaults to a new local Pool.
+    """
     skip_cleanup = getenv('SUBCONVERT_SKIP_CLEANUP')
     if skip_cleanup:
         sys.stderr.write("Temporary images will not be removed.\n")
@@ -259,28 +1188,166 @@ def read_subs(directory) -> Iterator[TextLine]:
 
     images = sorted(glob(f'{directory}/*.png'))
     # find the timestamps for all images
-    image_times = [int(image[-10:-4]) / FRAME_RATE for image in images]
+    image_times = [frame_time(image) for image in images]
     # add an extra "dummy" timestamp
     image_times.append(image_times[-1] + 5)
+    # frames marked empty during extraction aren't OCRed, but their
+    # timestamps still end the lines before them
+    read = [i for i, image in enumerate(images) if not is_empty(image)]
 
-    pool = Pool()
-    results = [pool.apply_async(read_image, (image,)) for image in images]
+    if getenv('SUBCONVERT_ASYNC') and pool is None:
+        # tesseract is the bottleneck; one event loop keeps it busy
+        results = asyncio.run(_read_images_async([images[i] for i in read],
+                                                 region, frame_size))
+    else:
+        results = _read_pooled([images[i] for i in read], region, pool,
+                               frame_size)
 
-    for i, result in enumerate(results):
-        for line in result.get():
+    done = 0  # the images before this one have been read
+    for i, lines in zip(read, results):
+        for line in lines:
             line.end = image_times[i+1]
             yield line
         if not skip_cleanup:
-            os.remove(images[i])
+            for image in images[done:i+1]:
+                os.remove(image)
+        done = i + 1
+    if not skip_cleanup:
+        for image in images[done:]:
+            os.remove(image)
     sys.stderr.write('\n')
 
 
+def _read_pooled(images: list[str], region=None, pool=None,
+                 frame_size=None) -> Iterator[list[TextLine]]:
+    """
+    Read the images in a pool, see read_subs, and yield the lines of each in
+    order.
+    """
+    pool = pool or Pool(governor.plan().workers, stats.reset)
+    batch = batch_size()
+    if batch > 1:
+        results = [pool.apply_async(_read_images_stats,
+                                    (images[i:i+batch], region,
+                                     frame_size))
+                   for i in range(0, len(images), batch)]
+    else:
+        results = [pool.apply_async(_read_image_stats,
+                                    (image, region, frame_size))
+                   for image in images]
+
+    for result in results:
+        frame_lines, worker_stats = result.get()
+        stats.merge(worker_stats)
+        if batch <= 1:
+            frame_lines = [frame_lines]
+        yield from frame_lines
+
+
+def _frame_times(log, times: SimpleQueue):
+    """
+    Pass the timestamps of the frames in an ffmpeg showinfo log to times,
+    followed by None at its end.
+    """
+    with log:
+        for line in log:
+            if match := SHOWINFO_TIME.search(line):
+                times.put(float(match[1]))
+    times.put(None)
+
+
+def _frame_lines(result, end: float) -> list[TextLine]:
+    if result is None:  # an empty frame
+        return []
+    lines, worker_stats = result.get()
+    stats.merge(worker_stats)
+    for line in lines:
+        line.end = end
+    return lines
+
+
+def read_frames(infile, stream, duration, region=None, pool=None
+                ) -> Iterator[TextLine]:
+    """
+    Extract and OCR the subtitles without writing the frames to disk, and
+    yield their lines in timestamp order. ffmpeg writes the frames to a pipe,
+    which is read straight into a framebuffer.FrameRing, and the pool workers
+    are only sent the slot of each frame.
+
+    args:
+        region: Only extract this (x, y, width, height) part of the frames.
+        pool: A multiprocessing Pool, whose workers can attach to the ring.
+            Defaults to a new one.
+    """
+    workers = governor.plan().workers
+    pool = pool or Pool(workers, stats.reset)
+    frame_size = (stream['width'], stream['height'])
+    _, _, width, height = region or (0, 0, *frame_size)
+    ring = framebuffer.FrameRing(workers * RING_SLOTS_PER_WORKER,
+                                 (height, width, 3))
+    # the extraction runs alongside the OCR pool, as in follow_subtitles
+    ff = _extractor(infile, stream, duration, region=region, threads=1,
+                    raw=True)
+    progress = ExtractionProgress(duration)
+    progress.watch(ff)
+    times = SimpleQueue()
+    sys.stderr.write('Performing OCR...\n')
+    pending = deque()  # (timestamp, result) of the frames being read
+    try:
+        ff.start(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        threading.Thread(target=_frame_times, args=(ff.proc.stderr, times),
+                         daemon=True).start()
+        while True:
+            # blocks until a worker is done with a frame when all slots are
+            # in use, and ffmpeg blocks on the full pipe meanwhile
+            index = ring.acquire()
+            with ring.buffer(index) as buffer:
+                if ff.proc.stdout.readinto(buffer) < ring.slot_size:
+                    ring.release(index)
+                    break
+                # the test of _open_frame, but on the raw frame and before
+                # it is sent to a worker
+                empty = (np.frombuffer(buffer, np.uint8).reshape(-1, 3)
+                         .max(axis=0).sum() < TEXT_BRIGHTNESS)
+            timestamp = times.get()
+            if empty:
+                ring.release(index)
+                stats.count('frames.prefiltered')
+                pending.append((timestamp, None))
+                continue
+            stats.count('frames.shared')
+            pending.append((timestamp, pool.apply_async(
+                    _read_image_stats,
+                    (ring.slot(index, timestamp), region, frame_size),
+                    callback=lambda _, index=index: ring.release(index),
+                    error_callback=lambda _, index=index: ring.release(index)
+                    )))
+            while len(pending) > 1 and (pending[0][1] is None
+                                        or pending[0][1].ready()):
+                _, result = pending.popleft()
+                yield from _frame_lines(result, pending[0][0])
+        with stats.timer('ffmpeg.run'):
+            ff.wait()
+        progress.finish()
+        while pending:
+            timestamp, result = pending.popleft()
+            # add an extra "dummy" timestamp after the last frame
+            end = pending[0][0] if pending else timestamp + 5
+            yield from _frame_lines(result, end)
+        sys.stderr.write('\n')
+    finally:
+        if ff.is_running():
+            ff.proc.kill()
+        ring.close()
+
+
 def freq_sort(values: list[int]) -> list[int]:
     all_values = list(set(values))
     all_values.sort(key=values.count, reverse=True)
     return all_values
 
 
+@stats.timed('normalize_values')
 def normalize_values(lines: list[TextLine], height: int = 1080,
                      tolerance: float = 0.01) -> None:
     """
@@ -318,6 +1385,7 @@ def normalize_values(lines: list[TextLine], height: int = 1080,
                 break
 
 
+@stats.timed('merge_lines')
 def merge_lines(lines: list[TextLine]):
     for i, line1 in enumerate(lines):
         if line1.end < 0:
@@ -340,38 +1408,169 @@ def merge_lines(lines: list[TextLine]):
                 line2.start = line2.end = -1.0  # mark this line for later
 
 
-def read_subtitles(infile, stream, duration, font, skip_formatting=False):
+def _add_entry(subs: Subtitles, line: TextLine, font: str):
+    color = f'{line.color[2]:02X}{line.color[1]:02X}{line.color[0]:02X}'
+    style = subs.style(fontname=font, fontsize=line.size,
+                       primarycolour=color, italic=line.italic,
+                       bold=line.bold)  # , marginl=line.marginl,
+#                         marginr=line.marginr, marginv=line.marginv)
+    subs.entry(SubtitleEntry(line.content, line.start, line.end,
+                             style.name, marginl=line.marginl,
+                             marginr=line.marginr, marginv=line.marginv))
+
+
+def read_subtitles(infile, stream, duration, font, skip_formatting=False,
+                   extract_jobs=1, crop=False, adaptive=False, pool=None,
+                   shared_memory=False):
+    """
+    args:
+        shared_memory: Pass the frames to the OCR pool through shared memory
+            instead of png files, see read_frames. Requires a local pool, and
+            extracts with a single ffmpeg at the full rate.
+    """
     skip_cleanup = getenv('SUBCONVERT_SKIP_CLEANUP')
     subs = Subtitles(stream['width'], stream['height'])
+    if shared_memory and isinstance(pool, distributed.Coordinator):
+        sys.stderr.write('Remote workers have no access to shared memory, '
+                         'using png files instead\n')
+        shared_memory = False
 
-    if os.path.exists(WORKDIR):
+    if shared_memory:
+        sys.stderr.write('Extracting subpicture subtitles to shared '
+                         'memory...\n')
+    elif os.path.exists(WORKDIR):
         sys.stderr.write('Work directory already present, '
                          'skipping export...\n')
     else:
         os.mkdir(WORKDIR)
         sys.stderr.write('Exporting subpicture subtitles...\n')
+    sys.stderr.write(f'Using {governor.plan()}\n')
 
-    dump_subs(infile, stream, duration)
-    lines = list(read_subs(WORKDIR))
+    region = None
+    if crop:
+        region = find_region(infile, stream, duration)
+        if region:
+            sys.stderr.write('Subtitle region: {2}x{3}+{0}+{1}\n'.format(
+                    *region))
+    if shared_memory:
+        lines = list(read_frames(infile, stream, duration, region, pool))
+    else:
+        if adaptive:
+            dump_subs_adaptive(infile, stream, duration, region)
+        else:
+            dump_subs(infile, stream, duration, extract_jobs, region)
+        lines = list(read_subs(WORKDIR, region, pool,
+                               (stream['width'], stream['height'])))
     normalize_values(lines, stream['height'])
     merge_lines(lines)
     for line in [s for s in lines if s.end >= 0]:
-        color = f'{line.color[2]:02X}{line.color[1]:02X}{line.color[0]:02X}'
-        style = subs.style(fontname=font, fontsize=line.size,
-                           primarycolour=color, italic=line.italic,
-                           bold=line.bold)  # , marginl=line.marginl,
-#                             marginr=line.marginr, marginv=line.marginv)
-        subs.entry(SubtitleEntry(line.content, line.start, line.end,
-                                 style.name, marginl=line.marginl,
-                                 marginr=line.marginr, marginv=line.marginv))
+        _add_entry(subs, line, font)
 
     if skip_cleanup:
         sys.stderr.write('Skipping cleanup..\n')
-    else:
+    elif not shared_memory:
         os.rmdir(WORKDIR)
     sys.stderr.write('OCR Complete. Please check the output for accuracy.\n')
     return subs
 
+
+def _png_complete(image: str) -> bool:
+    """
+    Whether ffmpeg has finished writing a png file (it ends with an IEND
+    chunk).
+    """
+    try:
+        with open(image, 'rb') as png:
+            png.seek(-12, os.SEEK_END)
+            return png.read(12)[4:8] == b'IEND'
+    except OSError:
+        return False
+
+
+def follow_subtitles(infile, stream, font, outfile):
+    """
+    Convert the subtitles of a recording that is still being written, or of
+    a stream on stdin, and append each entry to outfile in srt format as soon
+    as it is final.
+
+    A line is final once the frame starting at its end has been read, since
+    no later frame can continue it. Merging therefore only ever looks at the
+    small window of lines which are not final yet.
+    """
+    skip_cleanup = getenv('SUBCONVERT_SKIP_CLEANUP')
+    subs = Subtitles(stream['width'], stream['height'])
+    os.makedirs(WORKDIR, exist_ok=True)
+    sys.stderr.write('Following subpicture subtitles...\n')
+    # the extraction runs alongside the OCR pool for the whole conversion
+    ff = _extractor(infile, stream, follow=True, threads=1)
+    ff.start()
+    pool = Pool(governor.plan().workers, stats.reset)
+
+    dispatched = set()
+    pending = []  # (image, result) in timestamp order
+    window = []  # lines which may still be merged or continued
+    history = []
+    read_until = -1.0  # the start of the last frame that was read
+    while True:
+        finished = ff.proc.poll() is not None
+        images = sorted(glob(f'{WORKDIR}/*.png'))
+        for image in images:
+            if image in dispatched:
+                continue
+            if not finished and not _png_complete(image):
+                break
+            dispatched.add(image)
+            pending.append((image, pool.apply_async(_read_image_stats,
+                                                    (image,))))
+
+        new_lines = False
+        while pending and pending[0][1].ready():
+            image, result = pending[0]
+            lines, worker_stats = result.get()
+            if lines:
+                # the lines end where the next frame starts
+                later = [i for i in images if i > image]
+                if later:
+                    end = frame_time(later[0])
+                elif finished:
+                    end = frame_time(image) + 5
+                else:
+                    break
+                for line in lines:
+                    line.end = end
+                window.extend(lines)
+                new_lines = True
+            pending.pop(0)
+            stats.merge(worker_stats)
+            read_until = frame_time(image)
+            if not skip_cleanup:
+                os.remove(image)
+
+        if new_lines:
+            normalize_values(history + window, stream['height'])
+            merge_lines(window)
+            window = [line for line in window if line.end >= 0]
+        done = finished and not pending
+        final = [line for line in window if done or line.end <= read_until]
+        if final:
+            final_ids = {id(line) for line in final}
+            window = [line for line in window if id(line) not in final_ids]
+            history = (history + final)[-FOLLOW_HISTORY:]
+            written = len(subs.entries)
+            for line in sorted(final, key=lambda line: line.start):
+                _add_entry(subs, line, font)
+            outfile.write(subs.srt(written))
+            outfile.flush()
+        if done:
+            break
+        time.sleep(FOLLOW_POLL)
+
+    pool.close()
+    if not skip_cleanup:
+        os.rmdir(WORKDIR)
+    sys.stderr.write('Input finished.\n')
+    return subs
+
 # ffmpeg -i video.mkv
 #  -f lavfi -i "color=size=1920x1080:rate=10:color=black"
 #  -filter_complex "[1:v][0:s]overlay,mpdecimate[out]"
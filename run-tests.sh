@@ -1,3 +1,3 @@
 #!/bin/sh
 
-python -m unittest tests/ocr_test.py tests/test_subtitles.py
+python -m unittest discover -s tests -p "*_test.py"
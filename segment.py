@@ -0,0 +1,140 @@
+"""
+Finds the lines of text in a subtitle frame, so that each one can be read by
+tesseract in single line mode instead of running its full page layout
+analysis.
+
+Subtitle frames are one to three horizontal lines of bright text on a black
+background. The bright pixels are split into connected components, roughly
+one per glyph. The glyphs of about the text height are grouped into lines by
+how much they overlap vertically, which keeps apart lines with only a row or
+two between them. The smaller components, such as the dots on an i, accents
+and punctuation, then join the line of the glyph below or above them.
+"""
+import numpy as np
+from PIL import Image
+
+from tesseract import Bbox
+
+# gray level above which a pixel is considered part of the text
+THRESHOLD = 32
+# components shorter than this share of the text height are fragments of a
+# glyph or punctuation, which don't start a line of their own
+MIN_GLYPH_HEIGHT = 0.4
+# the share of the shorter of two glyphs' heights they must overlap by to be
+# on the same line
+LINE_OVERLAP = 0.5
+
+
+def components(mask: np.ndarray) -> np.ndarray:
+    """
+    Label the 8-connected components of a 2d mask.
+    @return An array with a row of (x1, y1, x2, y2, pixels) for each
+        component, with exclusive x2 and y2.
+    """
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    if not len(rows):
+        return np.zeros((0, 5), int)
+
+    # union the runs which touch a run in the row above, diagonals included
+    parent = list(range(len(rows)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    row_start = np.searchsorted(rows, np.arange(mask.shape[0] + 1))
+    for y in range(1, mask.shape[0]):
+        above = range(row_start[y - 1], row_start[y])
+        if not above:
+            continue
+        j = above.start
+        for i in range(row_start[y], row_start[y + 1]):
+            # skip the runs above which end before this one starts
+            while j < above.stop and ends[j] < starts[i]:
+                j += 1
+            k = j
+            while k < above.stop and starts[k] <= ends[i]:
+                root_i, root_k = find(i), find(k)
+                if root_i != root_k:
+                    parent[root_k] = root_i
+                k += 1
+
+    roots = np.array([find(i) for i in range(len(rows))])
+    labels, index = np.unique(roots, return_inverse=True)
+    result = np.zeros((len(labels), 5), int)
+    result[:, 0:2] = np.iinfo(int).max
+    np.minimum.at(result[:, 0], index, starts)
+    np.minimum.at(result[:, 1], index, rows)
+    np.maximum.at(result[:, 2], index, ends)
+    np.maximum.at(result[:, 3], index, rows + 1)
+    np.add.at(result[:, 4], index, ends - starts)
+    return result
+
+
+def _overlap(a: tuple[int, int], b: tuple[int, int]) -> int:
+    return min(a[1], b[1]) - max(a[0], b[0])
+
+
+def find_lines(image: Image.Image, threshold: int = THRESHOLD,
+               min_pixels: int = 20) -> list[Bbox]:
+    """
+    Find the bounding box of each line of text in a grayscale frame.
+    @param image The grayscale frame, with bright text on a dark background.
+    @param threshold Gray level above which a pixel is part of the text.
+    @param min_pixels Lines with fewer bright pixels than this are noise.
+    @return The boxes, top to bottom.
+    """
+    mask = np.asarray(image) > threshold
+    found = components(mask)
+    if not len(found):
+        return []
+    heights = np.sort(found[:, 3] - found[:, 1])
+    # the taller half of the components are the glyphs' bodies
+    text_height = np.median(heights[len(heights) // 2:])
+    glyph = found[:, 3] - found[:, 1] >= text_height * MIN_GLYPH_HEIGHT
+
+    # group the glyphs into lines, from the top
+    lines = []  # [y1, y2, components]
+    glyphs = sorted(np.flatnonzero(glyph),
+                    key=lambda i: found[i, 1] + found[i, 3])
+    for i in glyphs:
+        x1, y1, x2, y2, _ = found[i]
+        for line in lines:
+            if (_overlap(line[:2], (y1, y2))
+                    >= min(y2 - y1, line[1] - line[0]) * LINE_OVERLAP):
+                line[0], line[1] = min(line[0], y1), max(line[1], y2)
+                line[2].append(i)
+                break
+        else:
+            lines.append([y1, y2, [i]])
+
+    # the other components join the line of the nearest glyph in the same
+    # columns, or else the nearest line
+    owner = {i: n for n, line in enumerate(lines) for i in line[2]}
+    for i in np.flatnonzero(~glyph):
+        x1, y1, x2, y2, _ = found[i]
+        # a negative overlap is the distance between the rows
+        below_or_above = [j for j in owner
+                          if _overlap((x1, x2), found[j, [0, 2]]) > 0]
+        if below_or_above:
+            nearest = max(below_or_above,
+                          key=lambda j: _overlap((y1, y2), found[j, [1, 3]]))
+            line = lines[owner[nearest]]
+        else:
+            line = max(lines, key=lambda line: _overlap((y1, y2), line[:2]))
+        line[2].append(i)
+
+    boxes = []
+    for _, _, members in lines:
+        parts = found[members]
+        if parts[:, 4].sum() < min_pixels:
+            continue
+        boxes.append(Bbox(int(parts[:, 0].min()), int(parts[:, 1].min()),
+                          int(parts[:, 2].max()), int(parts[:, 3].max())))
+    return sorted(boxes, key=lambda box: box.y1)
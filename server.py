@@ -0,0 +1,333 @@
+"""
+A conversion daemon, so that short conversions don't pay for starting Python,
+importing PIL and NumPy and starting a pool of OCR processes every time. The
+server keeps one warm Pool, which also keeps the per-process state of its
+workers (such as the correction store) open between jobs.
+
+Jobs are subexport command lines, submitted over a Unix socket with the
+same one JSON message per line protocol as distributed.py. The server
+streams back what the conversion writes to stderr, which includes its
+progress, and finally the result. Jobs run one at a time, since a job already
+keeps the whole pool busy and the frames of all jobs share ocr.WORKDIR. The
+queue takes jobs from its clients in turn, so a client submitting many jobs
+doesn't hold up the others.
+
+Start it with `subexport.py serve`, and submit jobs with `subexport.py
+--server ...` or the Client class.
+"""
+import getpass
+import io
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from multiprocessing.pool import Pool
+from queue import SimpleQueue
+from typing import Iterator
+
+import distributed
+import governor
+import ocr
+import stats
+import subexport
+
+SOCKET = os.getenv('SUBCONVERT_SOCKET') or os.path.join(
+        os.getenv('XDG_RUNTIME_DIR') or tempfile.gettempdir(),
+        'subexport.sock')
+# options which configure the processes started with the server, so that
+# they can't change between its jobs
+SERVER_OPTIONS = ('corrections', 'workers', 'tesseract_threads',
+                  'ffmpeg_threads')
+
+
+class FairQueue:
+    """
+    A queue of jobs which hands them out from one client after another.
+    """
+    def __init__(self):
+        self.queues = {}  # client: deque of jobs, in turn order
+        self.condition = threading.Condition()
+
+    def put(self, client: str, job) -> int:
+        """
+        Queue a job. Returns the number of jobs queued before it.
+        """
+        with self.condition:
+            ahead = len(self)
+            self.queues.setdefault(client, deque()).append(job)
+            self.condition.notify()
+            return ahead
+
+    def get(self):
+        with self.condition:
+            while not self.queues:
+                self.condition.wait()
+            client = next(iter(self.queues))
+            jobs = self.queues.pop(client)
+            job = jobs.popleft()
+            if jobs:
+                # the client's next job waits for its next turn
+                self.queues[client] = jobs
+            return job
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self.queues.values())
+
+
+@dataclass
+class Job:
+    argv: list[str]
+    cwd: str
+    tty: bool = False
+    events: SimpleQueue = field(default_factory=SimpleQueue)
+    cancelled: bool = False
+
+
+class _Log(io.TextIOBase):
+    """
+    The log of a job, which sends what is written to it to the client.
+    """
+    def __init__(self, job: Job):
+        self.job = job
+
+    def write(self, text: str) -> int:
+        self.job.events.put({'op': 'log', 'text': text})
+        return len(text)
+
+    def isatty(self) -> bool:
+        return self.job.tty
+
+
+# the log of the job the current thread works on, if any
+_job_log: ContextVar[_Log | None] = ContextVar('job_log', default=None)
+
+
+class _JobStderr(io.TextIOBase):
+    """
+    Stands in for stderr while the server runs. What a job writes goes to
+    its log, and anything else to the server's own stderr. A thread doing
+    part of the job, such as reading the progress of its ffmpeg, has to run
+    in the context of the job's thread for its output to reach the log.
+    """
+    def __init__(self, stderr: io.TextIOBase):
+        self.stderr = stderr
+
+    def _target(self) -> io.TextIOBase:
+        return _job_log.get() or self.stderr
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def isatty(self) -> bool:
+        return self._target().isatty()
+
+
+@contextmanager
+def _environment():
+    """
+    Restore the environment of the server after a job has changed it.
+    """
+    saved = dict(os.environ)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+class Server:
+    """
+    args:
+        path: The Unix socket to listen on.
+        processes: The size of the OCR pool. Defaults to the governor's
+            workers.
+    """
+    def __init__(self, path: str = SOCKET, processes: int | None = None):
+        self.path = path
+        self.pool = Pool(processes or governor.plan().workers)
+        self.jobs = FairQueue()
+        self.running = None
+        self.listener = None
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            try:
+                with socket.socket(socket.AF_UNIX) as probe:
+                    probe.connect(self.path)
+            except OSError:
+                os.remove(self.path)  # left over from a server that died
+            else:
+                raise RuntimeError(f'A server is already running on '
+                                   f'{self.path}')
+        self.listener = socket.socket(socket.AF_UNIX)
+        self.listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.listener.listen()
+        stderr = sys.stderr
+        sys.stderr = _JobStderr(stderr)
+        threading.Thread(target=self._run_jobs, daemon=True).start()
+        try:
+            while True:
+                try:
+                    conn, _ = self.listener.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self._handle, args=(conn,),
+                                 daemon=True).start()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.pool.close()
+            sys.stderr = stderr
+
+    def shutdown(self):
+        self.listener.shutdown(socket.SHUT_RDWR)
+        self.listener.close()
+
+    def _handle(self, conn: socket.socket):
+        with conn, conn.makefile('rwb') as stream:
+            request = distributed.receive(stream)
+            match request and request['op']:
+                case 'status':
+                    distributed.send(stream, {
+                            'op': 'status', 'queued': len(self.jobs),
+                            'running': self.running and self.running.argv})
+                case 'convert':
+                    self._stream_job(stream, request)
+
+    def _stream_job(self, stream, request: dict):
+        job = Job(request['argv'], request['cwd'], request.get('tty', False))
+        ahead = self.jobs.put(request.get('client', ''), job)
+        try:
+            distributed.send(stream, {'op': 'queued', 'ahead': ahead})
+            while True:
+                event = job.events.get()
+                distributed.send(stream, event)
+                if event['op'] in ('done', 'error'):
+                    break
+        except OSError:
+            # the client went away; a job which hasn't started is dropped
+            job.cancelled = True
+
+    def _run_jobs(self):
+        while True:
+            job = self.jobs.get()
+            if job.cancelled:
+                continue
+            self.running = job
+            job.events.put({'op': 'started'})
+            log = _job_log.set(_Log(job))
+            try:
+                job.events.put(self._run(job))
+            # argparse and the conversion report errors with exit()
+            except (Exception, SystemExit) as e:
+                job.events.put({'op': 'error', 'error': repr(e)})
+                if (os.path.exists(ocr.WORKDIR)
+                        and not ocr.getenv('SUBCONVERT_SKIP_CLEANUP')):
+                    # the next job would take the frames left behind as its
+                    # own
+                    shutil.rmtree(ocr.WORKDIR)
+            finally:
+                _job_log.reset(log)
+                self.running = None
+                stats.snapshot(reset=True)
+
+    def _run(self, job: Job) -> dict:
+        args = subexport.argument_parser().parse_args(job.argv)
+        if args.follow:
+            raise ValueError('Follow mode is not supported by the server')
+        for name in SERVER_OPTIONS:
+            if getattr(args, name):
+                option = '--' + name.replace('_', '-')
+                raise ValueError(f"{option} can't change between the jobs of "
+                                 f"a server, set it in the environment of "
+                                 f"'subexport.py serve' instead")
+        for name in ('input', 'output', 'stats'):
+            if getattr(args, name):
+                setattr(args, name, os.path.join(job.cwd,
+                                                 getattr(args, name)))
+        with tempfile.TemporaryDirectory() as directory:
+            output = args.output
+            if not output:
+                # the subtitles are sent back instead
+                args.output = os.path.join(directory, 'subtitles')
+            with _environment(), stats.timer('total'):
+                subexport.configure(args)
+                subexport.convert(args, self.pool)
+            if args.stats:
+                stats.dump(args.stats)
+            result = {'op': 'done', 'output': output,
+                      'stats': stats.report()}
+            if not output:
+                with open(args.output) as infile:
+                    result['subtitles'] = infile.read()
+        return result
+
+
+class Client:
+    def __init__(self, path: str = SOCKET):
+        self.path = path
+
+    def _request(self, message: dict) -> Iterator[dict]:
+        with socket.socket(socket.AF_UNIX) as conn:
+            conn.connect(self.path)
+            with conn.makefile('rwb') as stream:
+                distributed.send(stream, message)
+                while (reply := distributed.receive(stream)) is not None:
+                    yield reply
+
+    def status(self) -> dict:
+        return next(self._request({'op': 'status'}))
+
+    def submit(self, argv: list[str], cwd: str | None = None,
+               client: str | None = None, tty: bool = False
+               ) -> Iterator[dict]:
+        """
+        Submit a job and iterate over its events: queued, started, log (the
+        text the conversion writes to stderr), and finally done or error.
+        @param argv The subexport command line of the job.
+        @param cwd The directory relative paths in argv are in. Defaults to
+            the current directory.
+        @param client Jobs are queued fairly between clients. Defaults to the
+            user name.
+        @param tty Whether the log is shown on a terminal, which gets
+            progress updates more often.
+        """
+        return self._request({'op': 'convert', 'argv': list(argv),
+                              'cwd': cwd or os.getcwd(),
+                              'client': client or getpass.getuser(),
+                              'tty': tty})
+
+    def convert(self, argv: list[str], log: io.TextIOBase | None = None,
+                **kwargs) -> dict:
+        """
+        Run a job and wait for it.
+        @param log Where the log of the job is written to.
+        @return The done event, with the output file name, or the subtitles
+            themselves if argv has no output, and the job's statistics.
+        @throws RuntimeError if the job failed.
+        """
+        for event in self.submit(argv, **kwargs):
+            match event['op']:
+                case 'log' if log:
+                    log.write(event['text'])
+                    log.flush()
+                case 'done':
+                    return event
+                case 'error':
+                    raise RuntimeError(event['error'])
+        raise RuntimeError('The server closed the connection')
+
+
+def serve(path: str = SOCKET, processes: int | None = None):
+    sys.stderr.write(f'Listening on {path}\n')
+    Server(path, processes).serve_forever()
@@ -0,0 +1,120 @@
+"""
+Lightweight timing and counter instrumentation.
+
+Timers record the number of calls, wall time, CPU time of this process and CPU
+time of waited-for child processes (ffmpeg, tesseract, ispell). Counters are
+plain integers. Everything is kept per process; pool workers hand back a
+snapshot with each result so the parent can merge them into one report.
+"""
+import json
+import os
+import time
+from collections import defaultdict
+from functools import wraps
+from inspect import iscoroutinefunction
+
+_timers = defaultdict(lambda: [0, 0.0, 0.0, 0.0])  # calls, wall, cpu, child
+_counters = defaultdict(int)
+
+
+def _child_cpu():
+    t = os.times()
+    return t.children_user + t.children_system
+
+
+class timer:
+    """
+    Context manager which adds the time spent inside it to the named timer.
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.child = _child_cpu()
+        return self
+
+    def __exit__(self, *_):
+        entry = _timers[self.name]
+        entry[0] += 1
+        entry[1] += time.perf_counter() - self.wall
+        entry[2] += time.process_time() - self.cpu
+        entry[3] += _child_cpu() - self.child
+
+
+def timed(name: str):
+    """
+    Decorator which records each call of the decorated function under the
+    given timer name.
+    """
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timer(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, n: int = 1):
+    _counters[name] += n
+
+
+def snapshot(reset: bool = False) -> dict:
+    """
+    Returns the current timers and counters of this process as plain
+    (picklable, JSON serializable) data.
+    @param reset Clear the recorded values after taking the snapshot.
+    """
+    snap = {'timers': {k: list(v) for k, v in _timers.items()},
+            'counters': dict(_counters)}
+    if reset:
+        _timers.clear()
+        _counters.clear()
+    return snap
+
+
+def reset():
+    """
+    Clears the recorded values. Pass it as the initializer of a Pool made
+    after some work has been recorded, or the forked workers hand back the
+    values they inherited along with their own.
+    """
+    _timers.clear()
+    _counters.clear()
+
+
+def merge(snap: dict):
+    """
+    Adds a snapshot taken in another process to the values of this one.
+    """
+    for name, values in snap['timers'].items():
+        entry = _timers[name]
+        for i, v in enumerate(values):
+            entry[i] += v
+    for name, n in snap['counters'].items():
+        _counters[name] += n
+
+
+def report() -> dict:
+    return {
+        'timers': {name: {'calls': calls, 'wall': round(wall, 6),
+                          'cpu': round(cpu, 6), 'child_cpu': round(child, 6)}
+                   for name, (calls, wall, cpu, child)
+                   in sorted(_timers.items())},
+        'counters': dict(sorted(_counters.items())),
+    }
+
+
+def dump(filename: str):
+    with open(filename, 'w') as outfile:
+        json.dump(report(), outfile, indent=2)
+        outfile.write('\n')
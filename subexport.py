@@ -1,16 +1,105 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 from argparse import ArgumentParser
 
+import distributed
 import ffmpeg
 import ocr
+import server
+import stats
 #  import subtitles
 
 SUBP_CODECS = ('hdmv_pgs_subtitle', 'dvd_subtitle', 'dvb_subtitle')
 
 
 def main(args):
+    if args.server:
+        remote(args)
+        return
+    configure(args)
+    with stats.timer('total'):
+        try:
+            if args.follow:
+                follow(args)
+            else:
+                convert(args)
+        except ffmpeg.Stalled:
+            sys.stderr.write('ffmpeg stopped making progress, the input may '
+                             'be damaged. Exiting...\n')
+            exit(-1)
+    if args.stats:
+        stats.dump(args.stats)
+
+
+def configure(args):
+    """
+    Pass the options which are read from the environment on to it.
+    """
+    if args.corrections:
+        # the OCR workers pick the store up from the environment
+        os.environ['SUBCONVERT_CORRECTIONS'] = args.corrections
+    if args.stall_timeout:
+        os.environ['SUBCONVERT_STALL_TIMEOUT'] = str(args.stall_timeout)
+    # the governor reads its overrides from the environment
+    for name, value in (('SUBCONVERT_WORKERS', args.workers),
+                        ('SUBCONVERT_TESSERACT_THREADS',
+                         args.tesseract_threads),
+                        ('SUBCONVERT_FFMPEG_THREADS', args.ffmpeg_threads)):
+        if value:
+            os.environ[name] = str(value)
+
+
+def follow(args):
+    if args.output_format not in ('srt', None) or (
+            args.output and not args.output.endswith('.srt')):
+        sys.stderr.write('Follow mode only supports srt output, exiting...\n')
+        exit(-1)
+    if args.input in ('-', 'pipe:', 'pipe:0'):
+        # a stream on stdin can't be probed without consuming it
+        width, height = (int(d) for d in args.video_size.split('x'))
+        input_stream = {'index': f's:{args.subtitle_stream}',
+                        'width': width, 'height': height}
+    else:
+        info = ffmpeg.info(args.input)
+        sub_streams = [s for s in info['streams']
+                       if s['codec_type'] == 'subtitle']
+        if not sub_streams:
+            sys.stderr.write('No subtitles found in the input file, '
+                             'exiting...')
+            exit(-1)
+        input_stream = sub_streams[args.subtitle_stream]
+        if input_stream['codec_name'] not in SUBP_CODECS:
+            sys.stderr.write('Text subtitles are not yet supported for '
+                             'input. Coming soon!')
+            exit(-1)
+
+    with open(args.output, 'w') if args.output else sys.stdout as outputfile:
+        ocr.follow_subtitles(args.input, input_stream, args.font, outputfile)
+
+
+def remote(args):
+    """
+    Have a running server do the conversion.
+    """
+    argv = [a for a in sys.argv[1:] if a not in ('-S', '--server')]
+    try:
+        result = server.Client().convert(argv, sys.stderr,
+                                         tty=sys.stderr.isatty())
+    except (OSError, RuntimeError) as e:
+        sys.stderr.write(f'The conversion failed: {e}\n')
+        exit(-1)
+    if 'subtitles' in result:
+        sys.stdout.write(result['subtitles'])
+
+
+def convert(args, pool=None):
+    """
+    args:
+        pool: Runs the OCR, see ocr.read_subs. With --listen, a coordinator
+            is used instead.
+    """
 
     info = ffmpeg.info(args.input)
     duration = float(info["format"]["duration"])
@@ -38,8 +127,21 @@ def main(args):
         sys.stderr.write(f'Using subtitle stream {args.subtitle_stream} - '
                          f'{input_stream["codec_long_name"]}\n')
     if input_stream['codec_name'] in SUBP_CODECS:
-        subs = ocr.read_subtitles(args.input, input_stream, duration,
-                                  args.font, args.skip_formatting)
+        coordinator = None
+        if args.listen:
+            coordinator = pool = distributed.Coordinator(
+                    distributed.parse_address(args.listen))
+            sys.stderr.write('Listening for workers on {}:{}\n'.format(
+                    *pool.address))
+        try:
+            subs = ocr.read_subtitles(args.input, input_stream, duration,
+                                      args.font, args.skip_formatting,
+                                      args.extract_jobs, args.crop,
+                                      args.adaptive, pool,
+                                      args.shared_memory)
+        finally:
+            if coordinator:
+                coordinator.close()
     else:
         sys.stderr.write('Text subtitles are not yet supported for input. '
                          'Coming soon!')
@@ -53,7 +155,12 @@ def main(args):
                 outputfile.write(subs.srt())
 
 
-if __name__ == '__main__':
+def worker(args):
+    sys.stderr.write(f'Running OCR tasks for {args.address}\n')
+    distributed.worker(distributed.parse_address(args.address), args.jobs)
+
+
+def argument_parser() -> ArgumentParser:
     argparser = ArgumentParser(usage="Subtitle-tools v0.1-pre\n"
                                "This application is intended to convert\n"
                                "subpicture-based subtitles into ssa/srt\n"
@@ -79,4 +186,108 @@ if __name__ == '__main__':
                            help="Skip all position and font size detection. "
                            "This is useful for import into a subtitle editor "
                            "when you want to perform manual formatting.")
-    main(argparser.parse_args())
+    argparser.add_argument('-j', '--extract-jobs', type=int,
+                           default=ocr.getenv('SUBCONVERT_EXTRACT_JOBS', 1),
+                           help="Split extraction into this many time chunks "
+                           "which are decoded by parallel ffmpeg processes. "
+                           "Default is 1, or SUBCONVERT_EXTRACT_JOBS.")
+    argparser.add_argument('-C', '--crop', action="store_true",
+                           default=bool(ocr.getenv('SUBCONVERT_CROP')),
+                           help="Pre-scan the subtitles to find the region "
+                           "of the frame they are shown in, and only extract "
+                           "and OCR that region. Default is SUBCONVERT_CROP.")
+    argparser.add_argument('-A', '--adaptive', action="store_true",
+                           default=bool(ocr.getenv('SUBCONVERT_ADAPTIVE')),
+                           help="Sample the subtitles coarsely to find where "
+                           "they change, then refine the timing of each "
+                           "change. Faster and more precise, but subtitles "
+                           "shorter than half a second may be missed. "
+                           "Default is SUBCONVERT_ADAPTIVE.")
+    argparser.add_argument('-M', '--shared-memory', action="store_true",
+                           default=bool(ocr.getenv(
+                                   'SUBCONVERT_SHARED_MEMORY')),
+                           help="Pass the frames to the OCR processes "
+                           "through shared memory rather than png files in "
+                           f"{ocr.WORKDIR}. Not used with --listen, and "
+                           "-j and -A are ignored. Default is "
+                           "SUBCONVERT_SHARED_MEMORY.")
+    argparser.add_argument('-F', '--follow', action="store_true",
+                           help="Follow an input file which is still being "
+                           "recorded, or a stream on stdin (-i -), and "
+                           "write each subtitle as soon as it is complete. "
+                           "Only srt output is supported.")
+    argparser.add_argument('--video-size', default='1920x1080',
+                           help="The video size of a stream read from stdin "
+                           "in follow mode. Default is 1920x1080.")
+    argparser.add_argument('-c', '--corrections', default=None,
+                           metavar='FILE',
+                           help="Learn how disagreements between the OCR "
+                           "engines are resolved in this database, and reuse "
+                           "known resolutions. Default is "
+                           "SUBCONVERT_CORRECTIONS. Inspect it with "
+                           "corrections.py.")
+    argparser.add_argument('-l', '--listen', default=None,
+                           metavar='HOST:PORT',
+                           help="Also hand the OCR of frames to workers on "
+                           "other machines, started with 'subexport.py "
+                           "worker HOST:PORT', which connect to this "
+                           "address.")
+    argparser.add_argument('-S', '--server', action="store_true",
+                           help="Submit the conversion to a running "
+                           "'subexport.py serve' instead of converting here. "
+                           "Its socket is SUBCONVERT_SOCKET, or "
+                           f"{server.SOCKET}.")
+    argparser.add_argument('-w', '--workers', type=int, default=None,
+                           help="The number of OCR processes. Default is "
+                           "SUBCONVERT_WORKERS, or sized to the CPUs and "
+                           "memory available (including cgroup limits).")
+    argparser.add_argument('--tesseract-threads', type=int, default=None,
+                           help="The OpenMP threads of each tesseract "
+                           "process. Default is SUBCONVERT_TESSERACT_THREADS, "
+                           "or the CPUs left over by the OCR processes.")
+    argparser.add_argument('--ffmpeg-threads', type=int, default=None,
+                           help="The threads of the extracting ffmpeg. "
+                           "Default is SUBCONVERT_FFMPEG_THREADS, or the "
+                           "available CPUs.")
+    argparser.add_argument('--stall-timeout', type=int, default=None,
+                           metavar='SECONDS',
+                           help="Give up if ffmpeg reports no progress for "
+                           "this many seconds while extracting. Default is "
+                           "SUBCONVERT_STALL_TIMEOUT, or to wait forever.")
+    argparser.add_argument('--stats', default=None, metavar='FILE',
+                           help="Write timing and counter statistics for "
+                           "each processing stage to FILE as JSON.")
+    return argparser
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['worker']:
+        workerparser = ArgumentParser(prog=f'{sys.argv[0]} worker',
+                                      description="Run the OCR of a "
+                                      "subexport started with --listen on "
+                                      "another machine.")
+        workerparser.add_argument('address', metavar='HOST:PORT',
+                                  help="The --listen address of the "
+                                  "coordinating subexport.")
+        workerparser.add_argument('-j', '--jobs', type=int, default=None,
+                                  help="The number of frames read at once. "
+                                  "Default is sized to the CPUs and memory "
+                                  "available, see governor.py.")
+        worker(workerparser.parse_args(sys.argv[2:]))
+        exit(0)
+    if sys.argv[1:2] == ['serve']:
+        serveparser = ArgumentParser(prog=f'{sys.argv[0]} serve',
+                                     description="Run conversions submitted "
+                                     "with --server, keeping the OCR pool "
+                                     "running between them.")
+        serveparser.add_argument('-S', '--socket', default=server.SOCKET,
+                                 help="The Unix socket to listen on. Default "
+                                 f"is SUBCONVERT_SOCKET, or {server.SOCKET}.")
+        serveparser.add_argument('-j', '--jobs', type=int, default=None,
+                                 help="The number of OCR processes. Default "
+                                 "is sized to the CPUs and memory available, "
+                                 "see governor.py.")
+        serve_args = serveparser.parse_args(sys.argv[2:])
+        server.serve(serve_args.socket, serve_args.jobs)
+        exit(0)
+    main(argument_parser().parse_args())
@@ -136,9 +136,13 @@ class Subtitles:
         self.styles.append(style)
         return style
 
-    def srt(self):
+    def srt(self, first: int = 0):
+        """
+        Render the entries in srt format, starting with entry number first.
+        This lets a growing file be written out incrementally.
+        """
         buf = StringIO()
-        for i, entry in enumerate(self.entries):
+        for i, entry in enumerate(self.entries[first:], first):
             buf.write(f'{i + 1}\n{entry.srt()}\n')
         buf.seek(0)
         return buf.read()
@@ -1,35 +1,70 @@
 
+import asyncio
+import html
+import os
+import re
 import subprocess
+import weakref
 from xml.etree import ElementTree
 from collections import namedtuple
 from io import BytesIO
 
 from PIL import Image
 
+import governor
+import stats
+
 Bbox = namedtuple('Bbox', ['x1', 'y1', 'x2', 'y2'])
 
+# how images are piped to tesseract, 'pnm' or 'png'. See _encode.
+TRANSPORT = os.getenv('SUBCONVERT_TRANSPORT', 'pnm').lower()
+# how hOCR output is parsed, 'fast' or 'etree'. See parse_hocr.
+HOCR_PARSER = os.getenv('SUBCONVERT_HOCR_PARSER', 'fast').lower()
+
 
 class Word:
-    def __init__(self, word_el: ElementTree.Element):
-        self.italic = False
-        self.bold = False
-        self.unknown_style = []
-        attrs = word_el.get('title')
+    __slots__ = ('text', 'bbox', 'confidence', 'italic', 'bold',
+                 'unknown_style')
+
+    def __init__(self, text: str, bbox: Bbox, confidence: int = 0,
+                 italic: bool = False, bold: bool = False,
+                 unknown_style: list[str] | None = None):
+        self.text = text
+        self.bbox = bbox
+        self.confidence = confidence
+        self.italic = italic
+        self.bold = bold
+        self.unknown_style = unknown_style or []
+
+    @classmethod
+    def from_element(cls, word_el: ElementTree.Element) -> 'Word':
+        word = cls('', Bbox(0, 0, 0, 0))
+        word._parse_attrs(word_el.get('title'))
+        word.text = (' '.join(word_el.itertext())).strip()
+        sub_els = word_el.findall('.//')
+        for el in sub_els:
+            word._add_style(el.tag[el.tag.index('}') + 1:])
+        return word
+
+    def _parse_attrs(self, attrs: str):
         for attr in (a.strip() for a in attrs.split(';')):
             if attr.startswith('bbox '):
                 self.bbox = Bbox(*[int(coord) for coord in attr[5:].split()])
             if attr.startswith('x_wconf '):
                 self.confidence = int(attr[8:])
-        self.text = (' '.join(word_el.itertext())).strip()
-        sub_els = word_el.findall('.//')
-        for el in sub_els:
-            match el.tag[el.tag.index('}') + 1:]:
-                case 'em':
-                    self.italic = True
-                case 'strong':
-                    self.bold = True
-                case t:
-                    self.unknown_style.append(t)
+
+    def _add_style(self, tag: str):
+        match tag:
+            case 'em':
+                self.italic = True
+            case 'strong':
+                self.bold = True
+            case t:
+                self.unknown_style.append(t)
+
+    def translate(self, dx: int, dy: int):
+        x1, y1, x2, y2 = self.bbox
+        self.bbox = Bbox(x1 + dx, y1 + dy, x2 + dx, y2 + dy)
 
     def __str__(self):
         return self.text
@@ -39,18 +74,34 @@ class Word:
 
 
 class Line:
-    def __init__(self, line_el: ElementTree.Element):
-        self._parse_attrs(line_el.get('title'))
-        word_els = line_el.findall('.//{http://www.w3.org/1999/xhtml}'
-                                   'span[@class="ocrx_word"]')
-        self.words = [Word(el) for el in word_els]
+    __slots__ = ('bbox', 'baseline', 'size', 'descenders', 'ascenders',
+                 'words', 'confidence', 'italic', 'bold', 'has_italic',
+                 'has_bold')
+
+    def __init__(self, attrs: str, words: list[Word]):
+        """
+        @param attrs The title attribute of the hOCR line element
+        @param words The words in the line
+        """
+        self.bbox = Bbox(0, 0, 0, 0)
+        self.baseline = (0.0, 0)
+        self.size = self.descenders = self.ascenders = 0.0
+        self._parse_attrs(attrs)
+        self.words = words
         self.confidence = (sum((w.confidence for w in self.words))
-                           / len(self.words))
+                           / len(self.words)) if self.words else 0.0
         self.italic = all((w.italic for w in self.words))
         self.bold = all((w.bold for w in self.words))
         self.has_italic = any((w.italic for w in self.words))
         self.has_bold = any((w.bold for w in self.words))
 
+    @classmethod
+    def from_element(cls, line_el: ElementTree.Element) -> 'Line':
+        word_els = line_el.findall('.//{http://www.w3.org/1999/xhtml}'
+                                   'span[@class="ocrx_word"]')
+        return cls(line_el.get('title'),
+                   [Word.from_element(el) for el in word_els])
+
     def _parse_attrs(self, attrs: str):
         attr_list = (a.strip() for a in attrs.split(';'))
         for attr in attr_list:
@@ -66,6 +117,16 @@ class Line:
             if attr.startswith('x_ascenders '):
                 self.ascenders = float(attr[12:])
 
+    def translate(self, dx: int, dy: int):
+        """
+        Move this line and its words by the given offset. Used to map lines
+        read from a crop or a montage back to their source image.
+        """
+        x1, y1, x2, y2 = self.bbox
+        self.bbox = Bbox(x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+        for word in self.words:
+            word.translate(dx, dy)
+
     def __str__(self):
         return ' '.join((word.text for word in self.words))
 
@@ -75,6 +136,67 @@ class Line:
                 f'{"bold" if self.has_bold else ""}')
 
 
+def _encode(image: str | Image.Image, transport: str | None = None
+            ) -> bytes:
+    """
+    Serialize an image to be piped to tesseract.
+    @param transport 'pnm' writes an uncompressed PGM/PPM, which costs next to
+        nothing to write or to read. 'png' compresses the image first. The
+        default is TRANSPORT.
+    """
+    if isinstance(image, str):
+        image = Image.open(image)
+    buf = BytesIO()
+    if (transport or TRANSPORT) == 'png':
+        image.save(buf, 'png')
+    else:
+        if image.mode not in ('1', 'L', 'RGB'):
+            image = image.convert('RGB')
+        image.save(buf, 'ppm')
+    return buf.getvalue()
+
+
+def _command(oem: int, lang: str, *configs: str) -> tuple[str, ...]:
+    stats.count('subprocess.tesseract')
+    return ('tesseract', '-', '-', '-l', lang, '--oem', str(oem)) + configs
+
+
+def _run(command: tuple[str, ...], data: bytes) -> bytes:
+    tesseract = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL,
+                                 env=governor.tesseract_env())
+    out, _ = tesseract.communicate(data)
+    tesseract.wait()
+    return out
+
+
+_semaphores = weakref.WeakKeyDictionary()
+
+
+async def _run_async(command: tuple[str, ...], data: bytes) -> bytes:
+    """
+    Run tesseract as an asyncio subprocess. At most the governor's
+    tesseract_jobs of these run at once within an event loop. The process is
+    killed if the calling task is cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(governor.plan().tesseract_jobs)
+    async with _semaphores[loop]:
+        tesseract = await asyncio.create_subprocess_exec(
+                *command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, env=governor.tesseract_env())
+        try:
+            out, _ = await tesseract.communicate(data)
+        except asyncio.CancelledError:
+            tesseract.kill()
+            await tesseract.wait()
+            raise
+    return out
+
+
+@stats.timed('tesseract.simple_read')
 def simple_read(image: str | Image.Image, oem: int = 0, lang: str = 'eng'
                 ) -> str:
     """
@@ -90,21 +212,21 @@ def simple_read(image: str | Image.Image, oem: int = 0, lang: str = 'eng'
         See the tesseract documentation for other options.
     @return A string containing the text read.
     """
-    if isinstance(image, str):
-        image = Image.open(image)
-    png = BytesIO()
-    image.save(png, 'png')
-    png.seek(0)
-    command = ('tesseract', '-', '-', '-l', lang,
-               '--oem', str(oem))
-    tesseract = subprocess.Popen(command, stdin=subprocess.PIPE,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.DEVNULL)
-    out, _ = tesseract.communicate(png.read())
-    tesseract.wait()
+    out = _run(_command(oem, lang), _encode(image))
+    return out.decode('utf-8').strip()
+
+
+@stats.timed('tesseract.simple_read_async')
+async def simple_read_async(image: str | Image.Image, oem: int = 0,
+                            lang: str = 'eng') -> str:
+    """
+    The asyncio version of simple_read.
+    """
+    out = await _run_async(_command(oem, lang), _encode(image))
     return out.decode('utf-8').strip()
 
 
+@stats.timed('tesseract.read_image')
 def read_image(image: str | Image.Image, oem: int = 0, lang: str = 'eng'
                ) -> list[Line]:
     """
@@ -119,23 +241,182 @@ def read_image(image: str | Image.Image, oem: int = 0, lang: str = 'eng'
         See the tesseract documentation for other options.
     @returns list[Line] A list of Line objects with each line of text.
     """
-    if isinstance(image, str):
-        image = Image.open(image)
-    png = BytesIO()
-    image.save(png, 'png')
-    png.seek(0)
-    command = ('tesseract', '-', '-', '-l', lang,
-               '--oem', str(oem), 'hocr')
-    tesseract = subprocess.Popen(command, stdin=subprocess.PIPE,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.DEVNULL)
-    out, _ = tesseract.communicate(png.read())
-    tesseract.wait()
-    tree = ElementTree.fromstring(out)
+    return parse_hocr(_run(_command(oem, lang, 'hocr'), _encode(image)))
+
+
+@stats.timed('tesseract.read_image_async')
+async def read_image_async(image: str | Image.Image, oem: int = 0,
+                           lang: str = 'eng') -> list[Line]:
+    """
+    The asyncio version of read_image.
+    """
+    out = await _run_async(_command(oem, lang, 'hocr'), _encode(image))
+    return parse_hocr(out)
+
+
+def _single_line(lines: list[Line]) -> Line | None:
+    if not lines:
+        return None
+    # tesseract shouldn't split a single line, but keep the most complete one
+    return max(lines, key=lambda line: len(line.words))
+
+
+@stats.timed('tesseract.read_line')
+def read_line(image: str | Image.Image, oem: int = 0, lang: str = 'eng'
+              ) -> Line | None:
+    """
+    Call tesseract to read an image containing a single line of text. This
+    skips the page layout analysis done by read_image.
+    @param image A PIL Image or a file name
+    @param oem Which tesseract engine to use. See read_image.
+    @param lang The language engine to use.
+    @returns Line The line read, or None if no text was found.
+    """
+    out = _run(_command(oem, lang, '--psm', '7', 'hocr'), _encode(image))
+    return _single_line(parse_hocr(out))
+
+
+@stats.timed('tesseract.read_line_async')
+async def read_line_async(image: str | Image.Image, oem: int = 0,
+                          lang: str = 'eng') -> Line | None:
+    """
+    The asyncio version of read_line.
+    """
+    out = await _run_async(_command(oem, lang, '--psm', '7', 'hocr'),
+                           _encode(image))
+    return _single_line(parse_hocr(out))
+
+
+def parse_hocr(hocr: bytes | str) -> list[Line]:
+    """
+    Parse the lines out of a tesseract hOCR document, with the parser chosen
+    by HOCR_PARSER.
+    """
+    if HOCR_PARSER == 'etree':
+        return parse_hocr_etree(hocr)
+    return parse_hocr_fast(hocr)
+
+
+def parse_hocr_etree(hocr: bytes | str) -> list[Line]:
+    """
+    Parse the lines out of a tesseract hOCR document with ElementTree.
+    """
+    tree = ElementTree.fromstring(hocr)
     line_els = (el for el in
                 tree.findall('.//{http://www.w3.org/1999/xhtml}span')
                 if el.get('class') in ('ocr_line', 'ocr_header'))
-    return [Line(el) for el in line_els]
+    return [Line.from_element(el) for el in line_els]
+
+
+_HOCR_SPAN = re.compile(r"""<span class=['"]([a-z_]+)['"][^>]*?"""
+                        r"""title=(['"])(.*?)\2[^>]*>""")
+_HOCR_LINE_CLASSES = ('ocr_line', 'ocr_header', 'ocr_caption',
+                      'ocr_textfloat')
+_HOCR_TAG = re.compile(r'<(\w+)')
+_HOCR_MARKUP = re.compile(r'<[^>]*>')
+
+
+def parse_hocr_fast(hocr: bytes | str) -> list[Line]:
+    """
+    Parse the lines out of a tesseract hOCR document in a single pass over
+    the span tags, without building an element tree. This relies on the
+    fixed layout of the documents tesseract writes: words never contain
+    other spans, and each line's words follow it before the next line.
+    """
+    if isinstance(hocr, bytes):
+        hocr = hocr.decode('utf-8')
+    lines = []
+    words = None  # the words of the current line, if it's one we keep
+    attrs = None
+    for match in _HOCR_SPAN.finditer(hocr):
+        span_class, _, title = match.groups()
+        if span_class == 'ocrx_word':
+            if words is None:
+                continue
+            inner = hocr[match.end():hocr.find('</span>', match.end())]
+            word = Word(html.unescape(_HOCR_MARKUP.sub(' ', inner)).strip(),
+                        Bbox(0, 0, 0, 0))
+            word._parse_attrs(html.unescape(title))
+            for tag in _HOCR_TAG.findall(inner):
+                word._add_style(tag)
+            words.append(word)
+            continue
+        if span_class not in _HOCR_LINE_CLASSES:
+            continue
+        if words is not None:
+            lines.append(Line(attrs, words))
+        if span_class in ('ocr_line', 'ocr_header'):
+            words = []
+            attrs = html.unescape(title)
+        else:  # another kind of line, such as ocr_caption
+            words = None
+    if words is not None:
+        lines.append(Line(attrs, words))
+    return lines
+
+
+def montage(images: list[Image.Image], gap: int | None = None
+            ) -> tuple[Image.Image, list[tuple[int, int]]]:
+    """
+    Stack images vertically into one canvas, separated by blank gaps filled
+    with the background (top left pixel) of the first image.
+    @param images The images to stack. They are converted to the mode of the
+        first one.
+    @param gap The blank space between images. The default is half the
+        height of the tallest image, which keeps tesseract from joining text
+        from neighbouring images into one line.
+    @return The canvas and the (x, y) offset of each image in it.
+    """
+    mode = images[0].mode
+    if gap is None:
+        gap = max(20, max(i.height for i in images) // 2)
+    width = max(i.width for i in images) + 2 * gap
+    height = sum(i.height for i in images) + gap * (len(images) + 1)
+    canvas = Image.new(mode, (width, height), images[0].getpixel((0, 0)))
+    offsets = []
+    y = gap
+    for image in images:
+        canvas.paste(image.convert(mode), (gap, y))
+        offsets.append((gap, y))
+        y += image.height + gap
+    return canvas, offsets
+
+
+@stats.timed('tesseract.read_batch')
+def read_batch(images: list[Image.Image], oem: int = 0, lang: str = 'eng',
+               gap: int | None = None) -> list[list[Line]]:
+    """
+    Read several images with a single tesseract call by stacking them into
+    one montage.
+    @param images A list of PIL Images
+    @param oem Which tesseract engine to use. See read_image.
+    @param lang The language engine to use.
+    @param gap The blank space between images. See montage.
+    @returns list[list[Line]] The lines found in each image, with coordinates
+        relative to that image.
+    """
+    if len(images) == 1:
+        return [read_image(images[0], oem, lang)]
+    canvas, offsets = montage(images, gap)
+    results = [[] for _ in images]
+    for line in read_image(canvas, oem, lang):
+        center = (line.bbox.y1 + line.bbox.y2) / 2
+        for i, (image, (x, y)) in enumerate(zip(images, offsets)):
+            if y <= center < y + image.height:
+                line.translate(-x, -y)
+                results[i].append(line)
+                break
+    return results
+
+
+def simple_read_batch(images: list[Image.Image], oem: int = 0,
+                      lang: str = 'eng') -> list[str]:
+    """
+    Like simple_read, but reads several images with one tesseract call.
+    @return A string containing the text read from each image.
+    """
+    return ['\n'.join(str(line) for line in lines)
+            for lines in read_batch(images, oem, lang)]
 
 
 if __name__ == '__main__':  # test code
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+import corrections
+
+
+class CorrectionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = corrections.CorrectionStore(
+                os.path.join(self.tmpdir.name, 'corrections.db'))
+
+    def test_resolve(self):
+        for _ in range(corrections.MIN_COUNT - 1):
+            self.store.learn('| think so', 'I think sa', 'I think so')
+        self.assertIsNone(self.store.resolve('| think so', 'I think so'))
+        self.store.learn('| did', 'I did', 'I did')
+        self.assertEqual(self.store.resolve('| know', 'I know'), 'I know')
+        # 'sa' vs 'so' has been seen, but not often enough
+        self.assertIsNone(self.store.resolve('| know so', 'I know sa'))
+
+    def test_conflicting(self):
+        for _ in range(corrections.MIN_COUNT):
+            self.store.learn('0n', 'on', 'on')
+        self.store.learn('0n', 'on', '0n')
+        self.assertIsNone(self.store.lookup('0n', 'on'))
+
+    def test_prune(self):
+        self.store.learn('a b', 'a c', 'a b')
+        self.assertEqual(self.store.prune(expiry_days=0), 1)
+        self.assertEqual(self.store.entries(), [])
+
+    def test_prune_keeps_used(self):
+        for _ in range(corrections.MIN_COUNT):
+            self.store.learn('| did', 'I did', 'I did')
+        self.store.learn('0n', 'on', 'on')
+        # both were learned long ago, but one of them is still being used
+        with self.store.db:
+            self.store.db.execute('UPDATE corrections SET last_seen = 0')
+        self.assertEqual(self.store.resolve('| know', 'I know'), 'I know')
+        self.assertEqual(self.store.prune(), 1)
+        self.assertEqual([e[:4] for e in self.store.entries()],
+                         [('|', 'I', 'I', corrections.MIN_COUNT)])
+
+    def test_used_loses_trust(self):
+        for _ in range(corrections.MIN_COUNT):
+            self.store.learn('0n', 'on', 'on')
+        for _ in range(10):
+            self.assertEqual(self.store.resolve('0n it', 'on it'), 'on it')
+        # verified in a line with another disagreement, the other way
+        self.store.learn('0n 0ff', 'on off', '0n off')
+        self.assertIsNone(self.store.lookup('0n', 'on'))
+
+    def tearDown(self):
+        self.store.db.close()
+        self.tmpdir.cleanup()
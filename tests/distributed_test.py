@@ -0,0 +1,72 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+import distributed
+from ocr import TextLine
+
+
+@distributed.task
+def shout(filename: str, suffix: str) -> tuple[str, str]:
+    with open(filename) as infile:
+        return os.path.basename(filename), infile.read().upper() + suffix
+
+
+class DistributedTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.files = []
+        for n in range(5):
+            filename = os.path.join(self.directory.name, f'{n:06d}.txt')
+            with open(filename, 'w') as outfile:
+                outfile.write(f'frame {n}')
+            self.files.append(filename)
+
+    def start_worker(self, coordinator):
+        thread = threading.Thread(target=distributed.worker,
+                                  args=(coordinator.address, 1, True))
+        thread.start()
+        return thread
+
+    def test_remote(self):
+        with distributed.Coordinator(('127.0.0.1', 0), local=0) as pool:
+            results = [pool.apply_async(shout, (f, '!')) for f in self.files]
+            worker = self.start_worker(pool)
+            self.assertEqual([r.get(10) for r in results],
+                             [(f'{n:06d}.txt', f'FRAME {n}!')
+                              for n in range(5)])
+        worker.join(10)
+        self.assertFalse(worker.is_alive())
+
+    def test_lost_task(self):
+        with distributed.Coordinator(('127.0.0.1', 0), local=0) as pool:
+            result = pool.apply_async(shout, (self.files[0], ''))
+            # a worker which disappears while holding the task
+            with socket.create_connection(pool.address) as conn:
+                conn.sendall(b'{"op": "hello"}\n')
+                conn.makefile('rb').readline()
+            worker = self.start_worker(pool)
+            self.assertEqual(result.get(10)[1], 'FRAME 0')
+            self.assertEqual(result.attempts, 1)
+        worker.join(10)
+
+    def test_local(self):
+        with distributed.Coordinator(local=1) as pool:
+            self.assertEqual(pool.apply_async(shout, (self.files[1], '?'))
+                             .get(10)[1], 'FRAME 1?')
+
+    def test_unregistered(self):
+        with distributed.Coordinator(local=0) as pool:
+            self.assertRaises(ValueError, pool.apply_async, print, ('x',))
+
+    def test_encode(self):
+        line = TextLine(1.5, 'Hello', 54, True, False, 10, 20, 30,
+                        (255, 255, 0), 3.0)
+        value = [line, ({'a': 1}, None)]
+        self.assertEqual(distributed.decode(distributed.encode(value)),
+                         value)
+
+    def tearDown(self):
+        self.directory.cleanup()
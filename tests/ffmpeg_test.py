@@ -0,0 +1,53 @@
+import os
+import stat
+import sys
+import tempfile
+import unittest
+
+import ffmpeg
+
+# stands in for ffmpeg: writes two progress reports to the -progress pipe,
+# then hangs if asked to
+FAKE_FFMPEG = f'''#!{sys.executable}
+import os, sys, time
+fd = int(sys.argv[sys.argv.index('-progress') + 1][5:])
+for n, end in ((10, 'continue'), (20, 'end')):
+    os.write(fd, f'frame={{n}}\\nfps=5.0\\nout_time_us={{n * 100000}}\\n'
+                 f'speed=2.5x\\nprogress={{end}}\\n'.encode())
+    if 'hang' in sys.argv:
+        time.sleep(60)
+'''
+
+
+class ProgressTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.binary = os.path.join(self.directory.name, 'ffmpeg')
+        with open(self.binary, 'w') as script:
+            script.write(FAKE_FFMPEG)
+        os.chmod(self.binary, stat.S_IRWXU)
+
+    def test_callback(self):
+        reports = []
+        ff = ffmpeg.Ffmpeg('out', self.binary).progress(reports.append)
+        ff.run()
+        self.assertEqual(reports, [ffmpeg.Progress(10, 5.0, 1.0, 2.5),
+                                   ffmpeg.Progress(20, 5.0, 2.0, 2.5, True)])
+        self.assertFalse(ff.is_running())
+
+    def test_updates(self):
+        ff = ffmpeg.Ffmpeg('out', self.binary).progress()
+        ff.start()
+        self.assertEqual([p.frame for p in ff.updates()], [10, 20])
+        ff.wait()
+        self.assertEqual(ff.last_progress.out_time, 2.0)
+
+    def test_stall(self):
+        ff = ffmpeg.Ffmpeg('hang', self.binary).progress(stall_timeout=0.5)
+        ff.start()
+        self.assertTrue(ff.is_running())
+        self.assertRaises(ffmpeg.Stalled, ff.wait)
+        self.assertEqual(ff.last_progress.frame, 10)
+
+    def tearDown(self):
+        self.directory.cleanup()
@@ -0,0 +1,72 @@
+import io
+import threading
+import unittest
+from multiprocessing.pool import Pool
+from queue import SimpleQueue
+
+import numpy as np
+
+import framebuffer
+import ocr
+
+
+def total(slot: framebuffer.Slot) -> tuple[float, int]:
+    return slot.time, int(framebuffer.view(slot).sum())
+
+
+class FrameRingTest(unittest.TestCase):
+    def test_workers(self):
+        with framebuffer.FrameRing(2, (4, 6, 3)) as ring, Pool(2) as pool:
+            results = []
+            for n in range(5):
+                index = ring.acquire()
+                with ring.buffer(index) as buffer:
+                    buffer[:] = bytes([n]) * len(buffer)
+                results.append(pool.apply_async(
+                        total, (ring.slot(index, n / 10),),
+                        callback=lambda _, index=index: ring.release(index)))
+            self.assertEqual([r.get(10) for r in results],
+                             [(n / 10, n * 72) for n in range(5)])
+
+    def test_view(self):
+        with framebuffer.FrameRing(3, (2, 2, 3)) as ring:
+            slot = ring.slot(ring.acquire(), 1.5)
+            with ring.buffer(slot.index) as buffer:
+                buffer[:] = bytes(range(12))
+            frame = framebuffer.view(slot)
+            self.assertEqual(frame[1, 0].tolist(), [6, 7, 8])
+            with ring.buffer(slot.index) as buffer:
+                buffer[6] = 100
+            # a view, not a copy
+            self.assertEqual(frame[1, 0, 0], 100)
+            self.assertIsInstance(frame, np.ndarray)
+            del frame
+            framebuffer._attached.pop(ring.name).close()
+
+    def test_full(self):
+        ring = framebuffer.FrameRing(1, (1, 1, 3))
+        index = ring.acquire()
+        taken = threading.Event()
+        thread = threading.Thread(target=lambda: (ring.acquire(),
+                                                  taken.set()))
+        thread.start()
+        self.assertFalse(taken.wait(0.1))
+        ring.release(index)
+        self.assertTrue(taken.wait(10))
+        thread.join()
+        ring.close()
+
+
+class FrameTimesTest(unittest.TestCase):
+    def test_showinfo(self):
+        log = io.BytesIO(
+                b"Input #0, matroska,webm, from 'in.mkv':\n"
+                b"[Parsed_showinfo_3 @ 0x5581] config in time_base: 1/10\n"
+                b"[Parsed_showinfo_3 @ 0x5581] n:   0 pts:     12 "
+                b"pts_time:1.2     duration:      1 fmt:rgb24\n"
+                b"[Parsed_showinfo_3 @ 0x5581]   color_range:unknown\n"
+                b"[Parsed_showinfo_3 @ 0x5581] n:   1 pts:    403 "
+                b"pts_time:40.3    duration:      1 fmt:rgb24\n")
+        times = SimpleQueue()
+        ocr._frame_times(log, times)
+        self.assertEqual([times.get() for _ in range(3)], [1.2, 40.3, None])
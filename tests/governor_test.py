@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import governor
+
+GIB = 1024 * 1024 * 1024
+
+
+class CgroupTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+
+    def write(self, name, value):
+        filename = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as outfile:
+            outfile.write(value + '\n')
+
+    def test_v2(self):
+        self.write('cpu.max', '250000 100000')
+        self.write('memory.max', str(4 * GIB))
+        self.write('memory.current', str(GIB))
+        self.assertEqual(governor.cgroup_cpu_limit(self.root), 2.5)
+        self.assertEqual(governor.cgroup_memory_limit(self.root), 3 * GIB)
+
+    def test_v2_unlimited(self):
+        self.write('cpu.max', 'max 100000')
+        self.write('memory.max', 'max')
+        self.assertIsNone(governor.cgroup_cpu_limit(self.root))
+        self.assertIsNone(governor.cgroup_memory_limit(self.root))
+
+    def test_v1(self):
+        self.write('cpu/cpu.cfs_quota_us', '400000')
+        self.write('cpu/cpu.cfs_period_us', '100000')
+        self.write('memory/memory.limit_in_bytes', str(1 << 62))
+        self.assertEqual(governor.cgroup_cpu_limit(self.root), 4)
+        self.assertIsNone(governor.cgroup_memory_limit(self.root))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+@mock.patch.dict(os.environ)
+class PlanTest(unittest.TestCase):
+    def setUp(self):
+        for name in ('SUBCONVERT_WORKERS', 'SUBCONVERT_TESSERACT_JOBS',
+                     'SUBCONVERT_TESSERACT_THREADS', 'OMP_THREAD_LIMIT',
+                     'SUBCONVERT_FFMPEG_THREADS'):
+            os.environ.pop(name, None)
+
+    def test_cores(self):
+        self.assertEqual(governor.make_plan(32, 64 * GIB),
+                         governor.Plan(32, 32, 1, 32))
+
+    def test_quota_and_memory(self):
+        # 2.5 CPUs of quota, and memory for 2 workers
+        plan = governor.make_plan(2.5, governor.WORKER_MEMORY * 2 + 1)
+        self.assertEqual(plan, governor.Plan(2, 2, 1, 2))
+        plan = governor.make_plan(8, governor.WORKER_MEMORY * 2)
+        self.assertEqual((plan.workers, plan.tesseract_threads), (2, 4))
+
+    def test_overrides(self):
+        os.environ['SUBCONVERT_WORKERS'] = '4'
+        os.environ['OMP_THREAD_LIMIT'] = '3'
+        os.environ['SUBCONVERT_FFMPEG_THREADS'] = 'lots'
+        self.assertEqual(governor.make_plan(16, None),
+                         governor.Plan(4, 16, 3, 16))
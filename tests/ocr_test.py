@@ -1,6 +1,16 @@
 
+import io
+import os
+import tempfile
+import threading
 import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
 import ocr
+import tesseract
 
 
 class SpellCheckerTest(unittest.TestCase):
@@ -39,3 +49,304 @@ class SpellCheckerTest(unittest.TestCase):
 
     def tearDown(self):
         pass
+
+
+class EmptyFramesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for frame in (0, 12, 40):
+            with open(f'{self.directory.name}/{frame:06d}.png', 'wb') as png:
+                png.write(b'png')
+
+    def test_mark(self):
+        empty = ocr.EmptyFrames(None, self.directory.name)
+        empty._read_log(io.BytesIO(
+                b"[Parsed_metadata_4 @ 0x5581] frame:0    pts:0       "
+                b"pts_time:0\n"
+                b"[Parsed_metadata_4 @ 0x5581] lavfi.signalstats.YMAX=16\n"
+                b"[Parsed_metadata_4 @ 0x5581] frame:1    pts:12      "
+                b"pts_time:1.2\n"
+                b"[Parsed_metadata_4 @ 0x5581] lavfi.signalstats.YMAX=235\n"
+                b"[Parsed_metadata_4 @ 0x5581] frame:2    pts:40      "
+                b"pts_time:4\n"
+                b"[Parsed_metadata_4 @ 0x5581] lavfi.signalstats.YMAX=17\n"))
+        empty.thread = threading.Thread(target=lambda: None)
+        empty.thread.start()
+        empty.mark()
+        images = [f'{self.directory.name}/{frame:06d}.png'
+                  for frame in (0, 12, 40)]
+        self.assertEqual([ocr.is_empty(image) for image in images],
+                         [True, False, True])
+        self.assertEqual([ocr.frame_time(image) for image in images],
+                         [0, 1.2, 4])
+
+    def test_all_empty(self):
+        for image in os.listdir(self.directory.name):
+            os.truncate(f'{self.directory.name}/{image}', 0)
+        # nothing is sent to be read
+        self.assertEqual(list(ocr.read_subs(self.directory.name,
+                                            pool=object())), [])
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class FakeIspell:
+    """
+    Stands in for the Popen of `ispell -a`, knowing only a few words.
+    """
+    WORDS = {'Hello', 'world'}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def communicate(self, data: bytes) -> tuple[bytes, None]:
+        out = '@(#) International Ispell Version 3.4.05\n'
+        for line in data.decode('utf-8').split('\n'):
+            out += ''.join('*\n' if word in self.WORDS else f'# {word} 0\n'
+                           for word in line.lstrip('^').split()) + '\n'
+        return out.encode('utf-8'), None
+
+
+class VoteTest(unittest.TestCase):
+    def vote(self, strings: list[str], checker=None) -> tuple[str, int]:
+        """
+        Add the readings in order until the vote is decided. Returns the
+        result and the number of readings it took.
+        """
+        vote = ocr.Vote(len(strings), checker)
+        for n, text in enumerate(strings):
+            vote.add(n, text)
+            if (result := vote.decide()) is not None:
+                return result, n + 1
+
+    def test_same_as_check(self):
+        for strings in (
+                ['F—f-f-f-f. . .', 'F-f-f-F-f...', 'F--f-f-f...',
+                 'F-f-f-f-f...', 'F-f-f-f-f. . .', 'F-f-f-f-f...',
+                 'F-f-f-f-f. . .'],
+                ["Wow, that con versation's on another level!",
+                 "Wow, that conversation''s on another level!",
+                 "Wow, that conversation’'s on another level!",
+                 "Wow, that conversation’'s on another level!",
+                 "Wow, that conversation's on another level!",
+                 'Wow, that con versation’s on another level!',
+                 'Wow, that conversation’s on another level!',
+                 'Wow, that con versatianis on another level!'],
+                ["This bl0ckhead was absurd enough to say",
+                 "This bloc/(head was absurd enough to say",
+                 "Th!s blockhead was absurd enough to say",
+                 "This blockhead was absurd en0ugh to say",
+                 "Th|s blockhead was absurd en0ugh to say",
+                 "This bl0ckhead was absurd enough to say",
+                 "Th|s blockhead was absurd enough to say"]):
+            self.assertEqual(self.vote(strings)[0],
+                             ocr.SpellChecker().check(strings))
+
+    def test_early(self):
+        strings = ['Hello world', 'Hello wor1d', 'Hello world',
+                   'Hello world', 'Hello world', 'Hel1o world', 'Hello']
+        # the last two readings can't outvote the first five
+        self.assertEqual(self.vote(strings), ('Hello world', 5))
+        self.assertEqual(ocr.SpellChecker().check(strings), 'Hello world')
+
+    def test_misspelled(self):
+        checker = ocr.SpellChecker()
+        checker.checker = 'ispell'
+        strings = ['Hello wor1d'] * 4 + ['Hello world'] * 3
+        with mock.patch.object(ocr.subprocess, 'Popen', FakeIspell):
+            self.assertEqual(checker.spelled(['Hello', 'wor1d', '...']),
+                             [True, False, False])
+            self.assertEqual(checker.check(strings), 'Hello world')
+            # a correct word in the remaining readings would still win
+            self.assertEqual(self.vote(strings, checker), ('Hello world', 7))
+            strings = ['Hello world'] * 4 + ['Hello wor1d'] * 3
+            self.assertEqual(self.vote(strings, checker), ('Hello world', 4))
+
+
+class StallTimeoutTest(unittest.TestCase):
+    def test_setting(self):
+        with mock.patch.dict(os.environ, {'SUBCONVERT_STALL_TIMEOUT': '30'}):
+            self.assertEqual(ocr.stall_timeout(), 30)
+        with mock.patch.dict(os.environ, {'SUBCONVERT_STALL_TIMEOUT': ''}):
+            self.assertIsNone(ocr.stall_timeout())
+
+    def test_invalid(self):
+        with (mock.patch.dict(os.environ,
+                              {'SUBCONVERT_STALL_TIMEOUT': '30s'}),
+              mock.patch('sys.stderr', new_callable=io.StringIO) as stderr):
+            self.assertIsNone(ocr.stall_timeout())
+        self.assertIn('SUBCONVERT_STALL_TIMEOUT=30s', stderr.getvalue())
+
+
+class TextBboxTest(unittest.TestCase):
+    def test_bbox(self):
+        image = Image.new('L', (200, 100))
+        image.paste(255, (50, 40, 150, 60))
+        self.assertEqual(ocr.text_bbox(image), (40, 30, 160, 70))
+        self.assertEqual(ocr.text_bbox(image, padding=100), (0, 0, 200, 100))
+
+    def test_empty(self):
+        self.assertIsNone(ocr.text_bbox(Image.new('L', (200, 100), 32)))
+
+    def test_read_images_dark(self):
+        # colored enough to pass _open_frame, but too dark to crop to
+        with tempfile.TemporaryDirectory() as directory:
+            image = f'{directory}/000012.png'
+            frame = Image.new('RGB', (200, 100))
+            frame.paste((0, 0, 200), (50, 40, 150, 60))
+            frame.save(image)
+            with mock.patch('tesseract.read_batch') as read_batch:
+                self.assertEqual(ocr.read_images([image]), [[]])
+            read_batch.assert_not_called()
+
+
+class TextLineTest(unittest.TestCase):
+    def text_line(self, image, bbox, **kwargs):
+        line = tesseract.Line('bbox {} {} {} {}; x_size 30'.format(*bbox),
+                              [])
+        return ocr._text_line('/tmp/work/000012.png', (image,), line, line,
+                              'Hello', **kwargs)
+
+    def test_region_margins(self):
+        frame = Image.new('RGB', (640, 480))
+        frame.paste((255, 255, 255), (200, 400, 440, 440))
+        full = self.text_line(frame, (200, 400, 440, 440))
+        region = (100, 380, 440, 80)
+        cropped = self.text_line(frame.crop((100, 380, 540, 460)),
+                                 (100, 20, 340, 60), region=region,
+                                 frame_size=(640, 480))
+        self.assertEqual((cropped.marginl, cropped.marginr, cropped.marginv),
+                         (full.marginl, full.marginr, full.marginv))
+        self.assertEqual((full.marginl, full.marginr, full.marginv),
+                         (0, 0, 27))
+
+
+class PngCompleteTest(unittest.TestCase):
+    def test_truncated(self):
+        with tempfile.TemporaryDirectory() as directory:
+            image = f'{directory}/000012.png'
+            Image.new('RGB', (200, 100), (255, 255, 255)).save(image)
+            self.assertTrue(ocr._png_complete(image))
+            with open(image, 'rb') as png:
+                data = png.read()
+            # ffmpeg is still writing it
+            with open(image, 'wb') as png:
+                png.write(data[:-12])
+            self.assertFalse(ocr._png_complete(image))
+            with open(image, 'wb') as png:
+                png.write(data[:5])
+            self.assertFalse(ocr._png_complete(image))
+            self.assertFalse(ocr._png_complete(f'{directory}/missing.png'))
+
+
+class StitchChunksTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.workdir = self.directory.name
+        patcher = mock.patch.object(ocr, 'WORKDIR', self.workdir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, chunk: int, frame: int, color: int):
+        directory = f'{self.workdir}/chunk{chunk:03d}'
+        os.makedirs(directory, exist_ok=True)
+        Image.new('RGB', (40, 20), (color,) * 3).save(
+                f'{directory}/{frame:06d}.png')
+
+    def frames(self) -> dict[str, int]:
+        return {name: Image.open(f'{self.workdir}/{name}').getpixel((0, 0))[0]
+                for name in sorted(os.listdir(self.workdir))}
+
+    def chunks(self, count: int) -> list[tuple[str, float, float]]:
+        # 15 second chunks, each decoded from 10 seconds early
+        return [(f'{self.workdir}/chunk{n:03d}', max(0, n * 15 - 10), n * 15)
+                for n in range(count)]
+
+    def test_overlap(self):
+        self.write(0, 0, 0)
+        self.write(0, 120, 255)
+        # decoded before the chunk's start, and also in the first chunk
+        self.write(1, 0, 0)
+        self.write(1, 70, 255)
+        # the subtitle still showing at the start of the chunk repeats the
+        # last frame of the first chunk
+        self.write(1, 100, 255)
+        self.write(1, 120, 0)
+        ocr._stitch_chunks(self.chunks(2))
+        self.assertEqual(self.frames(), {'000000.png': 0, '000120.png': 255,
+                                         '000170.png': 0})
+
+    def test_renumber(self):
+        self.write(0, 0, 0)
+        self.write(1, 100, 200)
+        self.write(1, 130, 0)
+        self.write(2, 100, 100)
+        self.write(2, 101, 0)
+        ocr._stitch_chunks(self.chunks(3))
+        # frames are named by their position on the whole timeline
+        self.assertEqual(self.frames(), {'000000.png': 0, '000150.png': 200,
+                                         '000180.png': 0, '000300.png': 100,
+                                         '000301.png': 0})
+        self.assertEqual([ocr.frame_time(f) for f in self.frames()],
+                         [0, 15, 18, 30, 30.1])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class AdaptiveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.workdir = self.directory.name
+        patcher = mock.patch.object(ocr, 'WORKDIR', self.workdir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def refine(self, frames: list[np.ndarray]) -> float:
+        self.target = f'{self.workdir}/000010.png'
+        Image.new('RGB', (40, 20), (255,) * 3).save(self.target)
+        with mock.patch.object(ocr, '_window_frames',
+                               return_value=frames) as window_frames:
+            refined = ocr._refine_change('in.mkv', {}, self.target, 5.0,
+                                         coarse_rate=2, fine_rate=20)
+        # the frames between the previous coarse sample and this one
+        self.assertEqual(window_frames.call_args.args[2:6], (0, 4.5, 5.0, 20))
+        return refined
+
+    def test_refine(self):
+        old = np.zeros((20, 40, 3), np.uint8)
+        new = np.full((20, 40, 3), 255, np.uint8)
+        # the change is at the fourth of the frames from 4.5 on
+        self.assertEqual(self.refine([old] * 3 + [new] * 8), 4.65)
+        self.assertEqual(self.refine([old] + [new] * 10), 4.55)
+
+    def test_refine_no_match(self):
+        old = np.zeros((20, 40, 3), np.uint8)
+        self.assertEqual(self.refine([old] * 11), 5.0)
+        self.assertEqual(self.refine([]), 5.0)
+
+    def test_dump(self):
+        def extract():
+            for frame in (0, 9, 1000003):
+                Image.new('RGB', (40, 20)).save(
+                        f'{self.workdir}/coarse/{frame:06d}.png')
+
+        ff = mock.Mock()
+        ff.run.side_effect = extract
+        with (mock.patch.object(ocr, '_extractor', return_value=ff),
+              mock.patch.object(ocr, 'ExtractionProgress'),
+              mock.patch.object(ocr, '_refine_change',
+                                side_effect=lambda *args: args[3] - 0.25
+                                ) as refine_change):
+            ocr.dump_subs_adaptive('in.mkv', {}, 600000, coarse_rate=2,
+                                   fine_rate=20)
+        # the first frame starts the stream and isn't refined
+        self.assertEqual(sorted(call.args[3]
+                                for call in refine_change.call_args_list),
+                         [4.5, 500001.5])
+        self.assertEqual(sorted(os.listdir(self.workdir)),
+                         ['000000000ms.png', '000004250ms.png',
+                          '500001250ms.png'])
@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+from PIL import Image, ImageDraw
+import segment
+
+
+class FindLinesTest(unittest.TestCase):
+    def test_two_lines(self):
+        image = Image.new('L', (640, 240))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((100, 100, 500, 140), fill=255)
+        draw.rectangle((150, 160, 450, 200), fill=255)
+        # the dot of an i, a few rows above the first line
+        draw.rectangle((120, 92, 124, 96), fill=255)
+        self.assertEqual(segment.find_lines(image),
+                         [(100, 92, 501, 141), (150, 160, 451, 201)])
+
+    def test_empty(self):
+        image = Image.new('L', (640, 240))
+        image.putpixel((10, 10), 255)
+        self.assertEqual(segment.find_lines(image), [])
+
+    def test_close_lines(self):
+        image = Image.new('L', (640, 240))
+        draw = ImageDraw.Draw(image)
+        # glyphs of two lines with a single blank row between them, and a
+        # descender of the first reaching past the top of the second
+        for x in range(100, 500, 40):
+            draw.rectangle((x, 100, x + 30, 140), fill=255)
+            draw.rectangle((x + 10, 142, x + 40, 182), fill=255)
+        draw.rectangle((302, 140, 305, 150), fill=255)
+        lines = segment.find_lines(image)
+        self.assertEqual([(box.y1, box.y2) for box in lines],
+                         [(100, 151), (142, 183)])
+
+    def test_broken_glyphs(self):
+        image = Image.new('L', (640, 240))
+        draw = ImageDraw.Draw(image)
+        for x in range(100, 400, 40):
+            draw.rectangle((x, 100, x + 30, 140), fill=255)
+        # a glyph read as two parts, such as an = or a faint E
+        draw.rectangle((420, 100, 450, 117), fill=255)
+        draw.rectangle((420, 123, 450, 140), fill=255)
+        # a comma below the baseline and a dash
+        draw.rectangle((455, 136, 458, 146), fill=255)
+        draw.rectangle((470, 118, 490, 121), fill=255)
+        self.assertEqual(segment.find_lines(image), [(100, 100, 491, 147)])
+
+    def test_components(self):
+        mask = np.zeros((6, 8), bool)
+        mask[0:2, 0:2] = True
+        mask[2, 2] = True  # touches the first diagonally
+        mask[4:6, 5:8] = True
+        self.assertEqual(segment.components(mask).tolist(),
+                         [[0, 0, 3, 3, 5], [5, 4, 8, 6, 6]])
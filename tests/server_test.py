@@ -0,0 +1,82 @@
+import contextvars
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import server
+
+
+class FairQueueTest(unittest.TestCase):
+    def test_turns(self):
+        jobs = server.FairQueue()
+        for job in ('a1', 'a2', 'a3'):
+            jobs.put('a', job)
+        self.assertEqual(jobs.put('b', 'b1'), 3)
+        jobs.put('c', 'c1')
+        jobs.put('b', 'b2')
+        self.assertEqual([jobs.get() for _ in range(6)],
+                         ['a1', 'b1', 'c1', 'a2', 'b2', 'a3'])
+        self.assertEqual(len(jobs), 0)
+
+
+class JobStderrTest(unittest.TestCase):
+    def test_threads(self):
+        stderr = server._JobStderr(io.StringIO())
+        job = server.Job([], '/')
+        other = threading.Thread(target=stderr.write, args=('server\n',))
+
+        def run_job():
+            server._job_log.set(server._Log(job))
+            stderr.write('job\n')
+            # a thread doing part of the job, like the progress of ffmpeg
+            part = threading.Thread(target=contextvars.copy_context().run,
+                                    args=(stderr.write, 'progress\n'))
+            part.start()
+            part.join()
+            other.start()
+            other.join()
+
+        thread = threading.Thread(target=run_job)
+        thread.start()
+        thread.join()
+        self.assertEqual(stderr.stderr.getvalue(), 'server\n')
+        self.assertEqual([job.events.get()['text'] for _ in range(2)],
+                         ['job\n', 'progress\n'])
+        self.assertTrue(job.events.empty())
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'subexport.sock')
+        self.server = server.Server(self.path, 1)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        while not os.path.exists(self.path):
+            time.sleep(0.01)
+        self.client = server.Client(self.path)
+
+    def test_status(self):
+        self.assertEqual(self.client.status(),
+                         {'op': 'status', 'queued': 0, 'running': None})
+
+    def test_bad_arguments(self):
+        log = io.StringIO()
+        with self.assertRaises(RuntimeError):
+            self.client.convert(['--no-such-option'], log)
+        self.assertIn('usage:', log.getvalue())
+        events = [e['op'] for e in self.client.submit(['--no-such-option'])]
+        self.assertEqual(events[:2], ['queued', 'started'])
+        self.assertEqual(events[-1], 'error')
+
+    def test_server_options(self):
+        with self.assertRaisesRegex(RuntimeError, '--workers'):
+            self.client.convert(['-i', 'in.sup', '--workers', '2'])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.directory.cleanup()
@@ -0,0 +1,29 @@
+import unittest
+import stats
+
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        stats.snapshot(reset=True)
+
+    def test_timed(self):
+        @stats.timed('test.func')
+        def func(x):
+            return x * 2
+
+        self.assertEqual(func(2), 4)
+        func(3)
+        timers = stats.report()['timers']
+        self.assertEqual(timers['test.func']['calls'], 2)
+
+    def test_merge(self):
+        stats.count('frames.processed', 3)
+        snap = stats.snapshot(reset=True)
+        self.assertEqual(stats.report()['counters'], {})
+        stats.count('frames.processed')
+        stats.merge(snap)
+        stats.merge(snap)
+        self.assertEqual(stats.report()['counters']['frames.processed'], 7)
+
+    def tearDown(self):
+        stats.snapshot(reset=True)
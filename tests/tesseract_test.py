@@ -0,0 +1,120 @@
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import tesseract
+from benchmarks import synthetic
+
+HOCR = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"\n'
+        '    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" '
+        'lang="en">\n'
+        ' <head>\n'
+        '  <title></title>\n'
+        '  <meta http-equiv="Content-Type" '
+        'content="text/html;charset=utf-8"/>\n'
+        "  <meta name='ocr-system' content='tesseract 5.3.0' />\n"
+        ' </head>\n'
+        ' <body>\n'
+        "  <div class='ocr_page' id='page_1' title='image \"-\"; bbox 0 0 "
+        "720 576; ppageno 0; scan_res 70 70'>\n"
+        "   <div class='ocr_carea' id='block_1_1' title=\"bbox 160 420 560 "
+        '500">\n'
+        "    <p class='ocr_par' id='par_1_1' lang='eng' title=\"bbox 160 420 "
+        '560 500">\n'
+        "     <span class='ocr_header' id='line_1_1' title=\"bbox 160 420 "
+        '560 456; baseline 0.002 -8; x_size 30; x_descenders 7; x_ascenders '
+        '8">\n'
+        "      <span class='ocrx_word' id='word_1_1' title='bbox 160 420 230 "
+        "448; x_wconf 91'><strong>Don&#39;t</strong></span>\n"
+        "      <span class='ocrx_word' id='word_1_2' title='bbox 240 420 330 "
+        "456; x_wconf 88'><strong><em>you</em></strong></span>\n"
+        "      <span class='ocrx_word' id='word_1_3' title='bbox 340 420 560 "
+        "448; x_wconf 76'>&quot;dare&quot;&amp;</span>\n"
+        '     </span>\n'
+        "     <span class='ocr_caption' id='line_1_2' title=\"bbox 200 464 "
+        '520 500; baseline 0 -6; x_size 30; x_descenders 6; x_ascenders 8">\n'
+        "      <span class='ocrx_word' id='word_1_4' title='bbox 200 464 520 "
+        "500; x_wconf 12'>~~~</span>\n"
+        '     </span>\n'
+        "     <span class='ocr_line' id='line_1_3' title=\"bbox 170 510 540 "
+        '546; baseline -0.003 -7; x_size 31; x_descenders 7; x_ascenders '
+        '9">\n'
+        "      <span class='ocrx_word' id='word_1_5' title='bbox 170 510 300 "
+        "546; x_wconf 95'><em>I</em></span>\n"
+        "      <span class='ocrx_word' id='word_1_6' title='bbox 310 510 540 "
+        "546; x_wconf 95'><em>said</em></span>\n"
+        '     </span>\n'
+        '    </p>\n'
+        '   </div>\n'
+        '  </div>\n'
+        ' </body>\n'
+        '</html>\n')
+
+
+def _fields(obj):
+    return {name: getattr(obj, name) for name in type(obj).__slots__
+            if name != 'words'}
+
+
+class ParseHocrTest(unittest.TestCase):
+    def assertSameLines(self, hocr):
+        expected = tesseract.parse_hocr_etree(hocr)
+        lines = tesseract.parse_hocr_fast(hocr)
+        self.assertEqual(len(lines), len(expected))
+        for line, expected_line in zip(lines, expected):
+            self.assertEqual(_fields(line), _fields(expected_line))
+            self.assertEqual([_fields(w) for w in line.words],
+                             [_fields(w) for w in expected_line.words])
+
+    def test_parity(self):
+        self.assertSameLines(HOCR)
+        self.assertSameLines(HOCR.encode('utf-8'))
+
+    def test_parity_synthetic(self):
+        for seed in range(20):
+            self.assertSameLines(synthetic.hocr(3, seed))
+
+    def test_fields(self):
+        header, line = tesseract.parse_hocr_fast(HOCR)
+        self.assertEqual(str(header), 'Don\'t you "dare"&')
+        self.assertEqual(header.bbox, (160, 420, 560, 456))
+        self.assertEqual(header.baseline, (0.002, -8))
+        self.assertEqual(header.size, 30.0)
+        self.assertTrue(header.has_bold)
+        self.assertFalse(header.italic)
+        self.assertTrue(line.italic)
+        self.assertEqual(line.confidence, 95)
+
+
+class MontageTest(unittest.TestCase):
+    def test_layout(self):
+        images = [Image.new('L', (100, 30), 0), Image.new('RGB', (60, 40))]
+        canvas, offsets = tesseract.montage(images)
+        # the gap is half the tallest image, but at least 20
+        self.assertEqual(offsets, [(20, 20), (20, 70)])
+        self.assertEqual(canvas.size, (140, 130))
+        self.assertEqual(canvas.mode, 'L')
+
+    def test_background(self):
+        images = [Image.new('L', (10, 10), 255), Image.new('L', (10, 10), 0)]
+        canvas, offsets = tesseract.montage(images, gap=5)
+        self.assertEqual(canvas.getpixel((0, 0)), 255)
+        x, y = offsets[1]
+        self.assertEqual(canvas.getpixel((x, y)), 0)
+
+    def test_read_batch(self):
+        images = [Image.new('L', (100, 30)), Image.new('L', (100, 30))]
+        _, offsets = tesseract.montage(images)
+        lines = []
+        for x, y in reversed(offsets):
+            line = tesseract.Line('bbox 0 0 0 0', [])
+            line.bbox = tesseract.Bbox(x + 5, y + 2, x + 50, y + 28)
+            lines.append(line)
+        with mock.patch.object(tesseract, 'read_image',
+                               return_value=lines):
+            results = tesseract.read_batch(images)
+        self.assertEqual([[line.bbox for line in r] for r in results],
+                         [[(5, 2, 50, 28)], [(5, 2, 50, 28)]])